@@ -12,14 +12,22 @@ import igraph as ig
 import pickle
 import pandas as pd
 import numpy as np
+from scipy import sparse
 import time
 import datetime
 from collections import defaultdict
 from itertools import combinations
+from itertools import chain
 import calendar
 import subprocess
 import os
+import json
 from tqdm import tqdm
+import cpd_patent_store
+import id_interning
+import cpd_projection
+import temporal_bipartite
+import get_bipartite_network_data
 
 
 def read_data(fp):
@@ -43,7 +51,51 @@ def get_ids_dates(df, c, id_date_dict, unique_ids):
     """ Gets data (ids & dates) from SureChemBL dataframe
 
     Builds a list of unique ids, and a dictionary of ids associated with the earliest date of entry.
-    Applied to both compounds or patents.
+    Applied to both compounds or patents. The date column is parsed once into datetime64, and the
+    earliest date of each id is found by sorting on that column and keeping the first row per id.
+    Results are merged into id_date_dict in bulk (only ids which are new or have an earlier date
+    are updated).
+
+    Args:
+        df: individual dataframe of SureChemBL data (from read_data())
+        c: "cpdID" or "patentID", depending on which data is used
+        id_date_dict: existing dictionary linking ids & dates
+        unique_ids: existing list of unique ids
+
+    Returns:
+        list of all unique ids, dictionary of all unique ids with earliest date of entry
+    """
+    #Find unique compounds
+    unique_ids = list(set(df[c].tolist() + unique_ids))
+
+    if df.empty:
+        return unique_ids, id_date_dict
+
+    #Parse dates once, then keep the earliest row of every id (stable sort keeps ties in row order)
+    parsed = pd.to_datetime(df["Date"], format="%Y-%m-%d").values
+    order = np.argsort(parsed, kind="stable")
+    ids = df[c].values[order]
+    first = ~pd.Series(ids).duplicated().values
+
+    earliest_ids = ids[first]
+    earliest_dates = df["Date"].values[order][first]
+    earliest_parsed = parsed[order][first]
+
+    #Compare against dates already in the dictionary - replace only if missing or earlier
+    previous = pd.to_datetime(pd.Series(earliest_ids).map(id_date_dict),
+                              format="%Y-%m-%d").values
+    replace = np.isnat(previous) | (earliest_parsed < previous)
+
+    id_date_dict.update(zip(earliest_ids[replace], earliest_dates[replace]))
+
+    return unique_ids, id_date_dict
+
+
+def get_ids_dates_iterrows(df, c, id_date_dict, unique_ids):
+    """ Row-by-row version of get_ids_dates()
+
+    Original implementation, kept as a reference for benchmark_get_ids_dates(). Calls
+    time.strptime twice per row, so it is very slow on full SureChemBL map files.
 
     Args:
         df: individual dataframe of SureChemBL data (from read_data())
@@ -71,13 +123,89 @@ def get_ids_dates(df, c, id_date_dict, unique_ids):
     return unique_ids, id_date_dict
 
 
+def write_synthetic_map(fp, n_rows, n_cpds, n_patents, start="2015-01-01",
+                        end="2019-12-31", seed=0):
+    """ Writes a synthetic SureChemBL map file, for testing & benchmarking
+
+    Rows are written in the tab-separated SureChEMBL_map_<update>.txt layout (cpd ID in the
+    first column, patent ID & date in the 5th & 6th), so the file can be read by read_data().
+
+    Args:
+        fp (string): filepath of the .txt file to write
+        n_rows (int): number of cpd-patent rows
+        n_cpds (int): number of distinct compound ids to draw from
+        n_patents (int): number of distinct patent ids to draw from
+        start (string, in form YYYY-MM-DD): earliest date
+        end (string, in form YYYY-MM-DD): latest date
+        seed (int): random seed
+
+    Returns:
+        None, but writes the synthetic map to fp
+    """
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(start, end, freq="D").strftime("%Y-%m-%d").values
+
+    df = pd.DataFrame({
+        "cpdID": np.char.add("SCHEMBL", rng.integers(0, n_cpds, n_rows).astype(str)),
+        "SMILES": "C",
+        "InChI": "InChI=1S/CH4/h1H4",
+        "InChIKey": "VNWKTOKETHGBQD-UHFFFAOYSA-N",
+        "patentID": np.char.add("US-", rng.integers(0, n_patents, n_rows).astype(str)),
+        "Date": days[rng.integers(0, len(days), n_rows)]
+    })
+    df.to_csv(fp, sep="\t", header=False, index=False)
+
+
+def benchmark_get_ids_dates(n_rows=200000, seed=0):
+    """ Compares get_ids_dates() with the row-by-row get_ids_dates_iterrows()
+
+    Builds a synthetic map file, runs both implementations over compounds & patents,
+    checks that the dictionaries and unique ids are identical, and prints timings.
+
+    Args:
+        n_rows (int): number of rows in the synthetic map file
+        seed (int): random seed
+
+    Returns:
+        dict: runtime (seconds) of each implementation
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fp = os.path.join(tmp, "SureChEMBL_map_synthetic.txt")
+        write_synthetic_map(fp, n_rows, n_rows // 5, n_rows // 50, seed=seed)
+        df = read_data(fp)
+
+    times = {}
+    results = {}
+    for label, f in [("iterrows", get_ids_dates_iterrows),
+                     ("columnar", get_ids_dates)]:
+        start = time.time()
+        #Split in two halves so merging into an existing dictionary is exercised
+        half = len(df) // 2
+        ids, dates = f(df.iloc[:half], "cpdID", {}, [])
+        ids, dates = f(df.iloc[half:], "cpdID", dates, ids)
+        patents, patent_dates = f(df, "patentID", {}, [])
+        times[label] = time.time() - start
+        results[label] = (set(ids), dates, set(patents), patent_dates)
+
+    assert results["iterrows"] == results["columnar"]
+    print("Rows:", len(df))
+    print("iterrows: {:.2f}s, columnar: {:.2f}s ({:.0f}x)".format(
+        times["iterrows"], times["columnar"],
+        times["iterrows"] / times["columnar"]))
+
+    return times
+
+
 def build_bipartite_network(cpds, patents, cpd_date_dict, patent_date_dict,
                             edges):
     """ Builds the igraph network of cpds & patents.
 
     Takes compounds, patents, and associated dates to build a bipartite igraph network. Compounds are linked
     to patents if a compound appears in a specific patent. Type (cpd vs patent) is specified through
-    the "type" variable.
+    the "type" variable. Edge endpoints are mapped to vertex indicies in bulk (cpds first, then
+    patents offset by the number of cpds), rather than one G.vs.find() per endpoint.
 
     Args:
         cpds: list of all unique cpd ids
@@ -95,6 +223,52 @@ def build_bipartite_network(cpds, patents, cpd_date_dict, patent_date_dict,
     G.add_vertices(len(cpds) + len(patents))
     G.vs["name"] = cpds + patents  #name field is the respective cpd/patent ID
 
+    #Add dates to each node
+    G.vs["date"] = [cpd_date_dict[cpd] for cpd in cpds
+                   ] + [patent_date_dict[patent] for patent in patents]
+
+    #Types - cpd:0, patent:1
+    G.vs["type"] = [0] * len(cpds) + [1] * len(patents)
+
+    ### Add edges ###
+    if len(edges) == 0:
+        return G
+
+    #Find the index of each cpd & patent id
+    edge_cpds, edge_patents = zip(*edges)
+    cpd_indicies = pd.Index(cpds).get_indexer(edge_cpds)
+    patent_indicies = pd.Index(patents).get_indexer(edge_patents)
+    if (cpd_indicies == -1).any() or (patent_indicies == -1).any():
+        raise ValueError("Edges contain cpds or patents which are not vertices")
+
+    G.add_edges(np.column_stack((cpd_indicies, patent_indicies + len(cpds))))
+
+    #print(ig.summary(G))
+    return G
+
+
+def build_bipartite_network_find(cpds, patents, cpd_date_dict, patent_date_dict,
+                                 edges):
+    """ Original version of build_bipartite_network(), using G.vs.find() per edge endpoint
+
+    Kept as a reference for benchmark_build_bipartite_network().
+
+    Args:
+        cpds: list of all unique cpd ids
+        patents: list of all unique patent ids
+        cpd_date_dict: dictionary associating all cpd ids with the earliest date of entry
+        patent_date_dict: dictionary associating all patent ids with the earliest date of entry
+        edges: list of tuples in (cpd_id, patent_id) form
+
+    Returns:
+        igraph network G
+    """
+    G = ig.Graph()
+
+    ### Add nodes ###
+    G.add_vertices(len(cpds) + len(patents))
+    G.vs["name"] = cpds + patents  #name field is the respective cpd/patent ID
+
     #Add dates to each node
     all_dates = []
     for cpd in cpds:
@@ -115,11 +289,214 @@ def build_bipartite_network(cpds, patents, cpd_date_dict, patent_date_dict,
             (G.vs.find(edge[0]).index, G.vs.find(edge[1]).index))
     G.add_edges(indexed_edges)
 
-    #print(ig.summary(G))
     return G
 
 
-def get_cpd_patent_info(data_fp):
+def benchmark_build_bipartite_network(n_edges=1000000, seed=0):
+    """ Compares build_bipartite_network() with build_bipartite_network_find()
+
+    Builds a synthetic month of map data with n_edges rows, builds the bipartite network with
+    both implementations, checks that the graphs are identical, and prints timings.
+
+    Args:
+        n_edges (int): number of rows in the synthetic month
+        seed (int): random seed
+
+    Returns:
+        dict: runtime (seconds) of each implementation
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fp = os.path.join(tmp, "SureChEMBL_map_synthetic.txt")
+        write_synthetic_map(fp, n_edges, n_edges // 5, n_edges // 50,
+                            start="2015-01-01", end="2015-01-31", seed=seed)
+        df = read_data(fp)
+
+    cpds, cpd_dates = get_ids_dates(df, "cpdID", {}, [])
+    patents, patent_dates = get_ids_dates(df, "patentID", {}, [])
+    edges = list(zip(df["cpdID"], df["patentID"]))
+
+    times = {}
+    graphs = {}
+    for label, f in [("find", build_bipartite_network_find),
+                     ("bulk", build_bipartite_network)]:
+        start = time.time()
+        graphs[label] = f(cpds, patents, cpd_dates, patent_dates, edges)
+        times[label] = time.time() - start
+
+    assert graphs["find"].get_edgelist() == graphs["bulk"].get_edgelist()
+    for attribute in ["name", "date", "type"]:
+        assert graphs["find"].vs[attribute] == graphs["bulk"].vs[attribute]
+
+    print("Edges:", len(edges))
+    print("find: {:.2f}s, bulk: {:.2f}s ({:.0f}x)".format(
+        times["find"], times["bulk"], times["find"] / times["bulk"]))
+
+    return times
+
+
+def read_data_chunks(fp, chunksize):
+    """ Read in SureChemBL data as an iterator of bounded-size dataframes
+
+    Same columns as read_data(), but only chunksize rows are held in memory at once.
+
+    Args:
+        fp: filepath to .txt file containing SureChemBL data
+        chunksize (int): number of rows per chunk
+
+    Returns:
+        iterator of pandas dataframes with columns cpdID, patentID, and Date
+    """
+    return pd.read_csv(fp,
+                       delimiter="\t",
+                       usecols=[0, 4, 5],
+                       names=["cpdID", "patentID", "Date"],
+                       dtype=str,
+                       chunksize=chunksize)
+
+
+def partition_map_file(fp, partition_fp, chunksize):
+    """ Routes rows of a SureChemBL map file into per-month partition files
+
+    Streams the map file in chunks and appends each row to a tab-separated file named
+    <YYYY-MM>.txt in partition_fp, so no more than one chunk is held in memory.
+
+    Args:
+        fp (string): filepath to SureChEMBL_map_<update>.txt
+        partition_fp (string): directory to write monthly partitions to
+        chunksize (int): number of rows read at once
+
+    Returns:
+        list: sorted list of months (YYYY-MM) with at least one row
+    """
+    months = set()
+    for chunk in read_data_chunks(fp, chunksize):
+        chunk = chunk.dropna(subset=["Date"])
+        for month, split in chunk.groupby(chunk["Date"].str[:7], sort=False):
+            split.to_csv(os.path.join(partition_fp, month + ".txt"),
+                         sep="\t",
+                         header=False,
+                         index=False,
+                         mode="a")
+            months.add(month)
+
+    return sorted(months)
+
+
+def partition_by_month(df, months):
+    """ Splits a date-sorted SureChemBL dataframe into monthly slices
+
+    The YYYY-MM key of every row is derived once, and the start & end rows of each month
+    are found with a binary search over those (sorted) keys. Each month is then a
+    positional slice of df, rather than the result of a full boolean scan.
+
+    Args:
+        df (pandas dataframe): SureChemBL map data, sorted by "Date"
+        months (list): months to return, in the form YYYY-MM
+
+    Returns:
+        iterator of (month, dataframe slice) tuples - months without data give an empty slice
+    """
+    keys = df["Date"].str[:7].values
+
+    for month in months:
+        start = keys.searchsorted(month, side="left")
+        end = keys.searchsorted(month, side="right")
+        yield month, df.iloc[start:end]
+
+
+def save_cpd_patent_month(split, month, fp, legacy=False, store_fp=None):
+    """ Saves compound & patent information for a single month of SureChemBL data
+
+    Builds unique cpds & patents, their earliest dates, and cpd-patent relations for
+    one month of map data, then pickles them to fp. If store_fp is given, the month is
+    written to the columnar store instead (see cpd_patent_store.py).
+
+    Args:
+        split (pandas dataframe): map data of one month (cpdID, patentID, Date)
+        month (string): month, in the form YYYY-MM
+        fp (string): filepath to CpdPatentIdsDates directory
+        legacy (bool): also save the legacy cpd-patent edge pickles
+            (see get_cpd_patent_relations())
+        store_fp (string): filepath to the root of a cpd_patent_store
+
+    Returns:
+        None, but saves unique_cpds, cpd_date_dict, unique_patents, patent_date_dict
+        pickles and cpd-patent relations for the month
+    """
+    print("\n----- Building", month, "-----")
+
+    print("-- Unique Cpds --")
+    cpds, cpd_dates = get_ids_dates(split, "cpdID", {}, [])
+
+    print("-- Unique Patents --")
+    patents, patent_dates = get_ids_dates(split, "patentID", {}, [])
+
+    if store_fp is not None:
+        cpd_patent_store.write_cpd_patent_month(split, cpd_dates, patent_dates,
+                                                month, store_fp)
+        return
+
+    #Build patent-cpd relationships for each month
+    get_cpd_patent_relations(split, "_" + month, fp, legacy)
+
+    #Save cpds & patents (including dictionaries)
+    pickle.dump(cpds,
+                file=open(fp + "unique_cpds_" + month + ".p", "wb"))
+    pickle.dump(cpd_dates,
+                file=open(fp + "cpd_date_dict_" + month + ".p", "wb"))
+    pickle.dump(patents,
+                file=open(fp + "unique_patents_" + month + ".p", "wb"))
+    pickle.dump(patent_dates,
+                file=open(fp + "patent_date_dict_" + month + ".p", "wb"))
+
+
+def get_cpd_patent_info_streaming(fp, out_fp, chunksize=5000000,
+                                  partition_fp=None, legacy=False,
+                                  store_fp=None):
+    """ Saves compound and patent information from one SureChemBL map file, in bounded memory
+
+    Streaming version of the per-update loop in get_cpd_patent_info(). The map file is read
+    in chunks and rows are routed into temporary per-month partition files, which are then
+    processed one month at a time. Peak memory depends on the chunk size and the largest
+    single month, not on the size of the full map file.
+
+    Args:
+        fp (string): filepath to SureChEMBL_map_<update>.txt
+        out_fp (string): filepath to CpdPatentIdsDates directory
+        chunksize (int): number of map rows held in memory while partitioning
+        partition_fp (string): directory for temporary partition files (defaults to
+            a temporary directory next to out_fp)
+        legacy (bool): also save the legacy cpd-patent edge pickles
+        store_fp (string): write months to this cpd_patent_store instead of pickles
+
+    Returns:
+        list: months (YYYY-MM) written by this update
+    """
+    import shutil
+    import tempfile
+
+    tmp_fp = tempfile.mkdtemp(prefix="map_partitions_",
+                              dir=partition_fp or out_fp)
+    try:
+        print("---- Partitioning", os.path.basename(fp), "----")
+        months = partition_map_file(fp, tmp_fp, chunksize)
+
+        for month in months:
+            split = pd.read_csv(os.path.join(tmp_fp, month + ".txt"),
+                                delimiter="\t",
+                                names=["cpdID", "patentID", "Date"],
+                                dtype=str)
+            save_cpd_patent_month(split, month, out_fp, legacy, store_fp)
+            del (split)
+    finally:
+        shutil.rmtree(tmp_fp)
+
+    return months
+
+
+def get_cpd_patent_info(data_fp, chunksize=None, legacy=False, store_fp=None):
     """ Saves compound and patent information from SureChemBL mapping
 
     Reads in all SureChemBL mapping data and creates lists of all unique compounds & patents, as well as
@@ -127,6 +504,11 @@ def get_cpd_patent_info(data_fp):
 
     Args:
         data_fp: filepath to SureChemBL mapping data(pre-downloaded)
+        chunksize (int): if given, stream each map file in chunks of this many rows
+            (see get_cpd_patent_info_streaming()) instead of loading it whole
+        legacy (bool): also save the legacy cpd-patent edge pickles
+        store_fp (string): if given, write months to this columnar store
+            (see cpd_patent_store.py) instead of pickles
 
     Returns:
         None, but saves all data to pickle files to "Data/CpdPatentIdsDates" directory
@@ -148,56 +530,28 @@ def get_cpd_patent_info(data_fp):
     ]
     test = ["20141231"]
     test = ["20150401"]  #Testing Agave
+    volume_fp = "/Volumes/Macintosh HD 4/SureChemBL/CpdPatentIdsDates/"
     for update in recent_updates[0:2]:  # in os.listdir(data_fp):  #full dataset
         f = "SureChEMBL_map_" + update + ".txt"
 
         print("---- Analzying", f, "----")
+        if chunksize:
+            get_cpd_patent_info_streaming(data_fp + f,
+                                          volume_fp,
+                                          chunksize,
+                                          legacy=legacy,
+                                          store_fp=store_fp)
+            continue
+
         df = read_data(data_fp + f)
         df = df.sort_values(by=["Date"])
         print(df.head())
 
         months = get_all_months(df["Date"].iloc[0], df["Date"].iloc[-1])
 
-        for month in months:
-            ## Note: variable declarations should be outside the for loop for full dataset analysis
-            cpds = []
-            cpd_dates = {}
-            patents = []
-            patent_dates = {}
-
-            criterion = df["Date"].map(lambda x: x.startswith(month[:-2]))
-            split = df[criterion]
-            print("\n----- Building", month[:-3], "-----")
-
-            print("-- Unique Cpds --")
-            cpds, cpd_dates = get_ids_dates(split, "cpdID", cpd_dates, cpds)
-
-            print("-- Unique Patents --")
-            patents, patent_dates = get_ids_dates(split, "patentID",
-                                                  patent_dates, patents)
-
-            #Build patent-cpd relationships for each month
-            get_cpd_patent_relations(split, "_" + month[:-3])
-
-            #Save cpds & patents (including dictionaries)
+        for month, split in partition_by_month(df, [m[:-3] for m in months]):
             ## Note: pickle dumps *should* be outside the for loop for full dataset analysis
-            volume_fp = "/Volumes/Macintosh HD 4/SureChemBL/CpdPatentIdsDates/"
-            pickle.dump(cpds,
-                        file=open(
-                            volume_fp + "unique_cpds_" + month[:-3] + ".p",
-                            "wb"))
-            pickle.dump(cpd_dates,
-                        file=open(
-                            volume_fp + "cpd_date_dict_" + month[:-3] + ".p",
-                            "wb"))
-            pickle.dump(patents,
-                        file=open(
-                            volume_fp + "unique_patents_" + month[:-3] + ".p",
-                            "wb"))
-            pickle.dump(patent_dates,
-                        file=open(
-                            volume_fp + "patent_date_dict_" + month[:-3] + ".p",
-                            "wb"))
+            save_cpd_patent_month(split, month, volume_fp, legacy, store_fp)
 
             # # Move all files to Google Drive
             # subprocess.run([
@@ -206,58 +560,222 @@ def get_cpd_patent_info(data_fp):
             # ])
 
 
-def get_cpd_patent_relations(df, label):
-    """ Builds a relation between compounds and patents
+def build_patent_cpd_index(df):
+    """ Builds a CSR-style index of the compounds found in each patent
 
-    Relates compounds to patents where they appear. The data structure used is a list of tuples
-    in (cpd, patent) form, with the ids of cpds & patents used as unique identifiers.
-    Also relates patents to all compounds which appear in them. This is a dictionary in
-    {patent: [cpds]} form, also with ids as unique identifiers.
+    Patents are numbered in order of first appearance, and the compounds of patent i are
+    cpds[offsets[i]:offsets[i + 1]], in the same order as the rows of df (duplicates kept,
+    matching the legacy {patent: [cpds]} dictionary).
 
     Args:
-        df: dataframe containing SureChemBL map data
+        df (pandas dataframe): SureChemBL map data (cpdID, patentID, Date)
 
     Returns:
-        None, but saves all data to pickle files to "Data/CpdPatentIdsDates" directory
-
+        patents (numpy array): patent ids
+        offsets (numpy array): int64 array of len(patents) + 1 row offsets
+        cpds (numpy array): compound ids, grouped by patent
     """
+    codes, patents = pd.factorize(df["patentID"])
+    order = np.argsort(codes, kind="stable")
+
+    offsets = np.zeros(len(patents) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=len(patents)), out=offsets[1:])
+
+    return np.asarray(patents), offsets, df["cpdID"].to_numpy()[order]
+
+
+def patent_cpd_index_to_dict(patents, offsets, cpds):
+    """ Expands a CSR patent-cpd index into the legacy {patent: [cpds]} dictionary
+
+    Args:
+        patents (numpy array): patent ids
+        offsets (numpy array): row offsets into cpds
+        cpds (numpy array): compound ids, grouped by patent
 
-    cpd_patent_edges = []
+    Returns:
+        defaultdict(list): links each patent to the compounds found in it
+    """
     patent_cpd_edges = defaultdict(list)
+    for patent, cpd_slice in zip(patents.tolist(),
+                                 np.split(cpds, offsets[1:-1])):
+        patent_cpd_edges[patent] = cpd_slice.tolist()
+
+    return patent_cpd_edges
+
+
+def save_patent_cpd_index(fp, label, patents, offsets, cpds):
+    """ Saves a CSR patent-cpd index (see build_patent_cpd_index()) to patent_cpd_index<label>.npz
+
+    Ids are stored as byte strings (1 byte per character, as in id_interning.py).
+
+    Args:
+        fp (string): filepath to directory holding patent-cpd relations
+        label (string): suffix of the saved file (e.g., "_YYYY-MM")
+        patents, offsets, cpds: CSR patent-cpd index
+
+    Returns:
+        None
+    """
+    np.savez(fp + "patent_cpd_index" + label + ".npz",
+             patents=np.asarray(patents, dtype=str).astype("S"),
+             offsets=offsets,
+             cpds=np.asarray(cpds, dtype=str).astype("S"))
+
+
+def load_patent_cpd_index(fp, label):
+    """ Loads a CSR patent-cpd index saved by save_patent_cpd_index()
+
+    Args:
+        fp (string): filepath to directory holding the index
+        label (string): suffix of the saved file (e.g., "_YYYY-MM")
+
+    Returns:
+        patents, offsets, cpds (see build_patent_cpd_index()), with ids as str
+    """
+    with np.load(fp + "patent_cpd_index" + label + ".npz") as data:
+        return data["patents"].astype(str), data["offsets"], data["cpds"].astype(str)
+
+
+def load_cpd_patent_edges(fp, label):
+    """ Loads deduplicated (cpd, patent) relations for a month, from either storage format
+
+    Uses the compact cpd_patent_edges<label>.npz file if present, otherwise falls back to
+    the legacy cpd_patent_edges<label>.p list of (cpd, patent) tuples.
+
+    Args:
+        fp (string): filepath to directory holding cpd-patent relations
+        label (string): suffix of the saved file (e.g., "_YYYY-MM")
+
+    Returns:
+        cpds, patents (numpy arrays): compound & patent id of every relation (as str)
+    """
+    if os.path.isfile(fp + "cpd_patent_edges" + label + ".npz"):
+        with np.load(fp + "cpd_patent_edges" + label + ".npz") as data:
+            return data["cpds"].astype(str), data["patents"].astype(str)
+
+    cpd_patent_edges = pickle.load(
+        file=open(fp + "cpd_patent_edges" + label + ".p", "rb"))
+    if len(cpd_patent_edges) == 0:
+        return np.array([], dtype=str), np.array([], dtype=str)
+    cpds, patents = zip(*cpd_patent_edges)
+
+    return np.array(cpds, dtype=str), np.array(patents, dtype=str)
+
+
+def load_patent_cpd_edges(fp, label):
+    """ Loads {patent: [cpds]} relations for a month, from either storage format
+
+    Uses the compact patent_cpd_index<label>.npz file if present, otherwise falls back to
+    the legacy patent_cpd_edges<label>.p pickle.
+
+    Args:
+        fp (string): filepath to directory holding patent-cpd relations
+        label (string): suffix of the saved file (e.g., "_YYYY-MM")
+
+    Returns:
+        dictionary linking each patent to the compounds found in it
+    """
+    if os.path.isfile(fp + "patent_cpd_index" + label + ".npz"):
+        return patent_cpd_index_to_dict(*load_patent_cpd_index(fp, label))
+
+    return pickle.load(file=open(fp + "patent_cpd_edges" + label + ".p", "rb"))
+
+
+def get_cpd_patent_relations(df, label,
+                             fp="/Volumes/Macintosh HD 4/SureChemBL/CpdPatentIdsDates/",
+                             legacy=False):
+    """ Builds a relation between compounds and patents
+
+    Relates compounds to patents where they appear, as deduplicated (cpd, patent) pairs
+    (see load_cpd_patent_edges()). Also relates patents to all compounds which appear in
+    them, as a CSR-style index (see build_patent_cpd_index()). Both are built directly from
+    the dataframe columns and saved as compact byte-string arrays; legacy=True additionally
+    saves the original list of tuples and {patent: [cpds]} dictionary pickles.
+
+    Args:
+        df: dataframe containing SureChemBL map data
+        label: suffix of the saved files (e.g., "_YYYY-MM")
+        fp: filepath to CpdPatentIdsDates directory
+        legacy: also save cpd_patent_edges<label>.p & patent_cpd_edges<label>.p pickles
 
-    #Extend an existing list of tuples, each tuple is a relation between (cpd, patent)
-    cpd_patent_edges.extend(
-        list(set([t for t in list(zip(df["cpdID"], df["patentID"]))])))
+    Returns:
+        None, but saves all data to "Data/CpdPatentIdsDates" directory
+
+    """
+    #Deduplicated (cpd, patent) relations
+    pairs = df[["cpdID", "patentID"]].drop_duplicates()
 
-    #Builds a dictionary of {patent: [cpd]} relations
+    #Builds a CSR index of {patent: [cpd]} relations
     print("-- Cpd-Patent Edges --")
-    for index, row in df.iterrows():  #, total=df.shape[0]:
-        patent_cpd_edges[row["patentID"]].append(row["cpdID"])
+    patents, offsets, cpds = build_patent_cpd_index(df)
 
-    ## Note: pickle dump should be outside for loop for full dataset
-    volume_fp = "/Volumes/Macintosh HD 4/SureChemBL/CpdPatentIdsDates/"
-    pickle.dump(cpd_patent_edges,
-                file=open(volume_fp + "cpd_patent_edges" + label + ".p", "wb"))
+    np.savez(fp + "cpd_patent_edges" + label + ".npz",
+             cpds=np.asarray(pairs["cpdID"], dtype=str).astype("S"),
+             patents=np.asarray(pairs["patentID"], dtype=str).astype("S"))
+    save_patent_cpd_index(fp, label, patents, offsets, cpds)
 
-    pickle.dump(patent_cpd_edges,
-                file=open(volume_fp + "patent_cpd_edges" + label + ".p", "wb"))
+    if legacy:
+        ## Note: pickle dump should be outside for loop for full dataset
+        pickle.dump(list(zip(pairs["cpdID"], pairs["patentID"])),
+                    file=open(fp + "cpd_patent_edges" + label + ".p", "wb"))
 
+        pickle.dump(patent_cpd_index_to_dict(patents, offsets, cpds),
+                    file=open(fp + "patent_cpd_edges" + label + ".p", "wb"))
 
-def build_cpd_network(cpds, cpd_date_dict, patent_cpd_links):
+
+def build_cpd_network(cpds, cpd_date_dict, patent_cpd_links, weighted=False,
+                      patent_date_dict=None, hub_policy=None, hub_threshold=1000):
     """ Builds a network of compounds, connected by occurrence within the same patent.
 
     Builds a igraph network with SureChemBL compounds as nodes, and edges between compounds
-    are created when two compounds appear in the same patent together.
+    are created when two compounds appear in the same patent together. By default this is a
+    multigraph, with one edge per shared patent. With weighted=True, duplicate edges are
+    collapsed into a single edge per compound pair with an integer "weight" attribute (the
+    number of shared patents), built with cpd_projection.py.
 
     Args:
         cpds: list of all unique compounds in SureChemBL
         cpd_date_dict: all compounds associated with date of first entry
         patent_cpd_links: finds all compounds associated with each patent
+        weighted: collapse duplicate edges into weighted edges
+        patent_date_dict: (weighted only) patents associated with date of entry - if given,
+            edges also get a "date" attribute with the first date the pair co-occurred
+        hub_policy: "skip", "sample", or "star" - how patents with more than hub_threshold
+            compounds are projected (see cpd_projection.apply_hub_policy()). The policy and
+            number of pairs it dropped are stored as graph attributes (edge dates from
+            patent_date_dict are not added).
+        hub_threshold: largest number of compounds in a patent before hub_policy applies
 
     Returns:
         an igraph network of SureChemBL compounds
 
     """
+    if hub_policy is not None:
+        C, report = cpd_projection.project_with_hub_policy(cpds, patent_cpd_links,
+                                                           hub_threshold,
+                                                           hub_policy)
+        G = cpd_projection.adjacency_to_graph(C, cpds, cpd_date_dict,
+                                              weighted=weighted,
+                                              repeat=not weighted)
+        G["hub_policy"] = report["policy"]
+        G["hub_threshold"] = report["threshold"]
+        for key in ["hub_patents", "hub_pairs", "hub_pairs_dropped"]:
+            G[key] = report[key]
+
+        return G
+
+    if weighted:
+        B = cpd_projection.build_incidence_matrix(cpds, patent_cpd_links)
+        C = cpd_projection.project_cpd_cpd(B)
+
+        first, dates = None, None
+        if patent_date_dict is not None:
+            first, dates = cpd_projection.first_cooccurrence_dates(
+                B, [patent_date_dict[p] for p in patent_cpd_links])
+
+        return cpd_projection.adjacency_to_graph(C, cpds, cpd_date_dict,
+                                                 first=first, dates=dates)
+
     G = ig.Graph()
 
     ### Add nodes ###
@@ -402,6 +920,33 @@ def build_month_list(start, end):
     return updates
 
 
+def update_id_table(table_fp, ids, dict_fp):
+    """ Adds ids to an interned id table (see id_interning.py) and saves the legacy dictionary
+
+    Ids already in the table keep their index, and new ids are appended after them, so
+    igraph indicies stay stable across rebuilds. If the table does not exist yet but a legacy
+    {id: index} dictionary does, the dictionary is converted first.
+
+    Args:
+        table_fp (string): directory of the id table
+        ids (list): SureChemBL ids (duplicates allowed)
+        dict_fp (string): filepath of the legacy {id: index} dictionary pickle
+
+    Returns:
+        None: saves the id table, and rewrites the dictionary at dict_fp
+    """
+    if not os.path.isfile(table_fp + "ids.npy") and os.path.isfile(dict_fp):
+        id_interning.convert_id_dict(pickle.load(file=open(dict_fp, "rb")),
+                                     table_fp)
+
+    print("New ids:", id_interning.append_ids(table_fp, ids))
+
+    #Legacy dictionary, for scripts which have not moved to the id table
+    ids = id_interning.load_id_table(table_fp)["ids"]
+    pickle.dump(dict(zip(ids.astype(str).tolist(), range(len(ids)))),
+                file=open(dict_fp, "wb"))
+
+
 def build_cpd_ID_mapping(fp):
     """ Builds a dictionary mapping SureChemBL IDs to numerical indicies,
     for ease of building an igraph network
@@ -410,17 +955,17 @@ def build_cpd_ID_mapping(fp):
         fp (string): filepath to location of compound data
 
     Returns:
-        none: does save dictionary to cp_ID_index_dict.p
+        none: does save id table to cpd_ID_table/ and dictionary to cp_ID_index_dict.p
     """
     allcpds = pd.read_pickle(fp + "SureChemBL_allCpds.p")
-    unique_cpds = list(set(allcpds["SureChEMBL_ID"].tolist()))
     print("Cpds with IDs:", len(allcpds["SureChEMBL_ID"].tolist()))
     print("All compounds:", len(allcpds))
     print("Unique cpds:", len(list(set(allcpds["SureChEMBL_ID"].tolist()))))
 
-    cpd_dict = dict(zip(unique_cpds, np.arange(0, len(unique_cpds), 1)))
-
-    pickle.dump(cpd_dict, file=open("../../../mnt/Archive/Shared/PatentData/SureChemBL/Cpd_Data/cpd_ID_index_dict.p", "wb"))
+    update_id_table(
+        "../../../mnt/Archive/Shared/PatentData/SureChemBL/Cpd_Data/cpd_ID_table/",
+        allcpds["SureChEMBL_ID"].values,
+        "../../../mnt/Archive/Shared/PatentData/SureChemBL/Cpd_Data/cpd_ID_index_dict.p")
 
 
 def build_patent_ID_mapping(updates, fp):
@@ -431,76 +976,173 @@ def build_patent_ID_mapping(updates, fp):
         fp (string): filepath to GDrive patent info
 
     Returns:
-        None: saves patent indicies to fp+"patent_ID_index_dict.p"
+        None: saves patent indicies to patent_ID_table/ and "patent_ID_index_dict.p"
     """
+    edges_fp = "../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/Patent_Cpd_Edges/"
     patents = []
     for update in tqdm(updates):
-        if os.path.isfile("../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/Patent_Cpd_Edges/patent_cpd_edges_" + update + ".p"):
+        if os.path.isfile(edges_fp + "patent_cpd_index_" + update + ".npz"):
+            #Compact index - only the patent array needs to be read
+            patents.extend(load_patent_cpd_index(edges_fp, "_" + update)[0].tolist())
+        elif os.path.isfile(edges_fp + "patent_cpd_edges_" + update + ".p"):
             try:
                 patent_edges = pickle.load(
-                    file=open("../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/Patent_Cpd_Edges/patent_cpd_edges_" + update + ".p", "rb"))
+                    file=open(edges_fp + "patent_cpd_edges_" + update + ".p", "rb"))
                 patents.extend(patent_edges.keys())
             except EOFError as e:
                 pass
 
-    unique_patents = list(set(patents))
     print("Patents from patent edges:", len(patents))
-    print("Unique patents:", len(unique_patents))
+    print("Unique patents:", len(set(patents)))
+
+    update_id_table(
+        "../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/patent_ID_table/",
+        patents,
+        "../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/patent_ID_index_dict.p")
+
+
+def load_patent_cpd_csr(fp, label):
+    """ Loads {patent: [cpds]} relations for a month as a CSR index, from either storage format
+
+    Args:
+        fp (string): filepath to directory holding patent-cpd relations
+        label (string): suffix of the saved file (e.g., "_YYYY-MM")
+
+    Returns:
+        patents, offsets, cpds (see build_patent_cpd_index())
+    """
+    if os.path.isfile(fp + "patent_cpd_index" + label + ".npz"):
+        return load_patent_cpd_index(fp, label)
+
+    patent_cpd_edges = pickle.load(
+        file=open(fp + "patent_cpd_edges" + label + ".p", "rb"))
+    lengths = [len(cpds) for cpds in patent_cpd_edges.values()]
+
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    cpds = np.array(list(chain.from_iterable(patent_cpd_edges.values())),
+                    dtype=str)
+
+    return np.array(list(patent_cpd_edges.keys()), dtype=str), offsets, cpds
+
+
+def translate_patent_cpd_index(patents, offsets, cpds, cpd_table, patent_table):
+    """ Replaces SureChemBL ids in a CSR patent-cpd index with igraph indicies
+
+    All compounds of the month are looked up in one vectorized call against the id table,
+    and compounds which are not in the table are dropped from their patent's range.
+    Patents are kept as patent id table indicies (not offset by the number of compounds), so
+    appending new compounds to the id table never invalidates saved indicies.
+
+    Args:
+        patents, offsets, cpds: CSR patent-cpd index (see build_patent_cpd_index())
+        cpd_table (dict): compound id table (from id_interning.load_id_table())
+        patent_table (dict): patent id table (from id_interning.load_id_table())
+
+    Returns:
+        patent_indicies (numpy array): patent id table index of every patent (add the number
+            of compounds for igraph indicies)
+        offsets (numpy array): row offsets into cpd_indicies
+        cpd_indicies (numpy array): igraph indicies of the compounds of every patent
+        failed (numpy array): boolean mask of cpds which were not in cpd_table
+    """
+    cpd_indicies = id_interning.encode(cpd_table, cpds)
+    failed = cpd_indicies == -1
+
+    #Shift each patent's range to account for dropped compounds
+    kept = np.zeros(len(cpds) + 1, dtype=np.int64)
+    np.cumsum(~failed, out=kept[1:])
+
+    patent_indicies = id_interning.encode(patent_table, patents)
+    if (patent_indicies == -1).any():
+        raise KeyError("Patents missing from the patent id table: " +
+                       str(patents[patent_indicies == -1][:10].tolist()))
+
+    return patent_indicies, kept[offsets], cpd_indicies[~failed], failed
+
+
+def load_patent_id_index(fp, update, legacy_num_cpds=0):
+    """ Loads a month of patent-cpd igraph indicies as a CSR index, from either storage format
+
+    Legacy patent_id_edges<update>.p pickles hold patent igraph indicies, offset by the
+    number of compounds when they were written - legacy_num_cpds is subtracted from them.
+
+    Args:
+        fp (string): filepath to Patent_ID_Edges directory
+        update (string): month, in the form YYYY-MM
+        legacy_num_cpds (int): number of compounds the legacy pickles were offset by
 
-    patent_ids = dict(zip(unique_patents, np.arange(0, len(unique_patents), 1)))
+    Returns:
+        patents, offsets, cpds: integer CSR index, with patents as patent id table indicies
+            (see translate_patent_cpd_index())
+    """
+    if os.path.isfile(fp + "patent_id_index" + update + ".npz"):
+        with np.load(fp + "patent_id_index" + update + ".npz") as data:
+            return data["patents"], data["offsets"], data["cpds"]
+
+    patent_index_edges = pickle.load(
+        file=open(fp + "patent_id_edges" + update + ".p", "rb"))
+    lengths = [len(cpds) for cpds in patent_index_edges.values()]
 
-    pickle.dump(patent_ids, file=open("../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/patent_ID_index_dict.p", "wb"))
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    cpds = np.fromiter(chain.from_iterable(patent_index_edges.values()),
+                       dtype=np.int64,
+                       count=offsets[-1])
 
+    return (np.fromiter(patent_index_edges.keys(), dtype=np.int64) - legacy_num_cpds,
+            offsets, cpds)
 
-def replaceIds(updates, fp, cpd_id_dict, patent_id_dict):
+
+def replaceIds(updates, fp, cpd_table, patent_table, keep_failed=False):
     """ Replace SureChemBL ids with igraph indicies - will save igraph memory
 
+    Each month is translated in one batch (see translate_patent_cpd_index()), and saved as
+    an integer CSR index (patent_id_index<update>.npz in Patent_ID_Edges).
+
     Args:
         updates (list): all months in a certain range (YYYY-MM)
         fp (string): filepath to compound data
-        cpd_id_dict (dictionary): links SureChemBL ids to igraph indicies
-        patent_id_dict (dictionary): links patent ids to igraph indicies
+        cpd_table (dict): compound id table (from id_interning.load_id_table())
+        patent_table (dict): patent id table (from id_interning.load_id_table())
+        keep_failed (bool): also return the SureChemBL ids which were not in cpd_table
 
     Returns:
-        none: saves each update to a pickle file
+        dict: links each month with the number of unmapped compounds (or, if keep_failed,
+        a (count, list of ids) tuple)
     """
-    #number to add to patents to avoid duplicate igraph indicies
-    num_cpds = len(cpd_id_dict)
-    print("Num Cpds:", num_cpds)
-    print("Num patents:", len(patent_id_dict))
-
-    print("Max cpd value:", max(cpd_id_dict.values()))
-    print("Max patent value:", max(patent_id_dict.values()))
+    print("Num Cpds:", len(cpd_table["ids"]))
+    print("Num patents:", len(patent_table["ids"]))
 
+    edges_fp = "../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/Patent_Cpd_Edges/"
+    id_edges_fp = "../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/Patent_ID_Edges/"
+    failures = {}
     for update in tqdm(updates):
         try:
-            patent_cpd_edges = pickle.load(
-                file=open("../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/Patent_Cpd_Edges/patent_cpd_edges_" + update + ".p", "rb"))
-        except EOFError as e:
-                pass
+            patents, offsets, cpds = load_patent_cpd_csr(edges_fp, "_" + update)
+        except (EOFError, FileNotFoundError) as e:
+            continue
 
-        patent_id_edges = {}  #New dictionary to hold patent/id relations
+        #Replace SureChemBL cpd ids with igraph indicies
+        patent_indicies, id_offsets, cpd_indicies, failed = translate_patent_cpd_index(
+            patents, offsets, cpds, cpd_table, patent_table)
 
         #Track number of compounds that do not appear in SureChemBL compound list
-        count = 0
-        failed = 0
-
-        #Replace SureChemBL cpd ids with igraph indicies
-        for patent, cpds in patent_cpd_edges.items():
-            indicies = []
-            count += len(cpds)
-            for cpd in cpds:
-                try:
-                    indicies.append(cpd_id_dict[cpd])
-                except:
-                    failed += 1  #Count failures if compound doesn't appear in cp_id_dict
-
-            #Link patent index with all compound indicies associated with it
-            patent_id_edges[patent_id_dict[patent] + num_cpds] = indicies
+        if keep_failed:
+            failures[update] = (int(failed.sum()), cpds[failed].tolist())
+        else:
+            failures[update] = int(failed.sum())
 
         #Save each month's edges
-        pickle.dump(patent_id_edges,
-                    file=open("../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/Patent_ID_Edges/patent_id_edges" + update + ".p", "wb"))
+        np.savez(id_edges_fp + "patent_id_index" + update + ".npz",
+                 patents=patent_indicies,
+                 offsets=id_offsets,
+                 cpds=cpd_indicies)
+
+    print("Unmapped cpds:",
+          sum(f[0] if keep_failed else f for f in failures.values()))
+
+    return failures
 
 
 def build_cpd_edgelist(updates, fp):
@@ -536,69 +1178,385 @@ def build_cpd_edgelist(updates, fp):
     del (edgelist)
 
 
+def append_bipartite_edges(fp, label, patents, cpds, dtype="int32"):
+    """ Appends a block of patent-cpd edges (usually one month) to a memory-mappable edgelist
+
+    Edges are stored as two fixed-width integer arrays, <fp>_patents.bin and <fp>_cpds.bin,
+    with a <fp>.json sidecar holding the dtype, total edge count and the [start, end) edge
+    range of every block. Patents are stored as patent id table indicies (not offset by the
+    number of compounds), so appending new compounds never invalidates stored edges.
+    Blocks already present are skipped, so reruns are safe. Bytes past the recorded edge
+    count (e.g. from an interrupted append) are truncated first.
+
+    Args:
+        fp (string): filepath prefix of the edgelist
+        label (string): label of the block - the month (YYYY-MM), or "YYYY-MM:<update>"
+            for edges added by apply_update()
+        patents (array-like): patent id table indicies
+        cpds (array-like): compound igraph indicies (same length as patents)
+        dtype (string): integer type of a new edgelist - int32 holds up to ~2.1B vertices
+
+    Returns:
+        dict: edgelist metadata (see load_bipartite_edges())
+    """
+    meta = {"dtype": dtype, "n_edges": 0, "months": {}}
+    if os.path.isfile(fp + ".json"):
+        with open(fp + ".json") as f:
+            meta = json.load(f)
+    if label in meta["months"]:
+        return meta
+
+    itemsize = np.dtype(meta["dtype"]).itemsize
+    for suffix, values in [("_patents.bin", patents), ("_cpds.bin", cpds)]:
+        with open(fp + suffix, "ab") as f:
+            f.truncate(meta["n_edges"] * itemsize)
+            np.asarray(values, dtype=meta["dtype"]).tofile(f)
+
+    meta["months"][label] = [meta["n_edges"], meta["n_edges"] + len(patents)]
+    meta["n_edges"] += len(patents)
+    with open(fp + ".json", "w") as f:
+        json.dump(meta, f)
+
+    return meta
+
+
+def load_bipartite_edges(fp):
+    """ Memory-maps an edgelist written by append_bipartite_edges()
+
+    Args:
+        fp (string): filepath prefix of the edgelist
+
+    Returns:
+        patents (numpy memmap): patent id table indicies of every edge (add the number of
+            compounds for igraph indicies)
+        cpds (numpy memmap): compound igraph indicies of every edge
+        meta (dict): dtype, n_edges, and months ({label: [start, end]} edge ranges)
+    """
+    with open(fp + ".json") as f:
+        meta = json.load(f)
+
+    #Empty files cannot be memory-mapped
+    if meta["n_edges"] == 0:
+        return (np.empty(0, dtype=meta["dtype"]), np.empty(0, dtype=meta["dtype"]),
+                meta)
+
+    patents = np.memmap(fp + "_patents.bin", dtype=meta["dtype"], mode="r",
+                        shape=(meta["n_edges"],))
+    cpds = np.memmap(fp + "_cpds.bin", dtype=meta["dtype"], mode="r",
+                     shape=(meta["n_edges"],))
+
+    return patents, cpds, meta
+
+
+def build_bipartite_csr(patents, cpds, num_cpds, n_vertices):
+    """ Builds a symmetric CSR adjacency matrix from patent-cpd edge arrays
+
+    Args:
+        patents (numpy array): patent id table indicies of every edge
+        cpds (numpy array): compound igraph indicies of every edge
+        num_cpds (int): number of compounds (patent vertices follow the compounds)
+        n_vertices (int): number of vertices (cpds + patents)
+
+    Returns:
+        scipy.sparse.csr_matrix: n_vertices x n_vertices adjacency (entries count edges)
+    """
+    patents = np.asarray(patents, dtype=np.int64) + num_cpds
+    rows = np.concatenate([patents, cpds])
+    cols = np.concatenate([cpds, patents])
+    data = np.ones(len(rows), dtype=np.int32)
+
+    return sparse.csr_matrix((data, (rows, cols)),
+                             shape=(n_vertices, n_vertices))
+
+
 def build_bipartite_edgelist(updates, fp):
     """ Builds patent-cpd edges using igraph indicies
 
+    Edges of each month are appended to two memory-mappable integer arrays
+    (see append_bipartite_edges()), instead of a single pickled list of tuples.
+
     Args:
         updates (list): list of months (YYYY-MM format)
         fp (string): filepath to CpdPatentIdsDates directory
 
     Returns:
-        None: saves edges to pickle file (index_edgelist_bipartite.p in CpdPatentIdsDates)
+        patents, cpds: memory-mapped edge arrays (see load_bipartite_edges())
     """
-    edges = []
+    edgelist_fp = "../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/index_edgelist_bipartite"
+    id_edges_fp = "../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/Patent_ID_Edges/"
+    legacy_num_cpds = 0
     max_value = 0
 
     for update in updates:
-        patent_index_edges = pickle.load(
-            file=open("../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/Patent_ID_Edges/patent_id_edges" + update + ".p", "rb"))
+        #Legacy pickles were offset by the size of the (legacy) compound dictionary
+        if not legacy_num_cpds and not os.path.isfile(id_edges_fp + "patent_id_index" +
+                                                      update + ".npz"):
+            legacy_num_cpds = len(pickle.load(file=open(
+                "../../../mnt/Archive/Shared/PatentData/SureChemBL/Cpd_Data/cpd_ID_index_dict.p",
+                "rb")))
 
-        for patent, cpds in patent_index_edges.items():
-            if patent > max_value:
-                max_value = patent
+        patents, offsets, cpds = load_patent_id_index(id_edges_fp, update,
+                                                      legacy_num_cpds)
 
-            for cpd in cpds:
-                edges.append((patent, cpd))
+        #One patent entry per linked compound (stored as patent table indicies)
+        patents = np.repeat(patents, np.diff(offsets))
+
+        if len(patents) > 0:
+            max_value = max(max_value, patents.max())
+
+        append_bipartite_edges(edgelist_fp, update, patents, cpds)
 
-    pickle.dump(edges,
-                file=open(
-                    "../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/index_edgelist_bipartite.p",
-                    "wb"))
     print("Max Value is:", max_value)
 
-    return edges
+    patents, cpds, meta = load_bipartite_edges(edgelist_fp)
+    return patents, cpds
 
 
-def build_full_bipartite_network(edgelist, cpd_id_dict, patent_id_dict):
+def build_full_bipartite_network(edgelist, cpd_table, patent_table,
+                                 chunksize=100000000, meta=None, months=None):
     """ Builds full igraph network containing patents and compounds
 
+    If the edgelist metadata is given, edges are added in month order and the network
+    carries month keys as graph attributes: G["months"] (sorted months) and
+    G["edge_offsets"] - edges of months 0 ... k are the first G["edge_offsets"][k + 1] edges.
+    A month slice is then a prefix of the edges (see
+    get_bipartite_network_data.build_subgraph()). Months are not stored per edge or vertex,
+    which would take one Python object each - the month of every edge follows from the
+    offsets, and the first month of every vertex is vertex_month of the temporal network
+    (see get_bipartite_network_data.build_temporal_network()).
+
     Args:
-        edgelist (list of sets): list of all edges between patent & compound indicies
-        cpd_id_dict (dict): links SureChemBL cpd ids with igraph indicies
-        patent_id_dict (dict): links patent ids with igraph indicies
+        edgelist (tuple): (patents, cpds) edge arrays, e.g. memory-mapped by load_bipartite_edges()
+            - patents are patent id table indicies
+        cpd_table (dict): compound id table (from id_interning.load_id_table()) - includes
+            compounds appended by apply_update(), unlike the legacy cpd_ID_index_dict.p
+        patent_table (dict): patent id table (from id_interning.load_id_table())
+        chunksize (int): number of edges copied out of the mapped arrays at once
+        meta (dict): edgelist metadata from load_bipartite_edges() - adds month keys
+        months (list): sorted months to key edges against (defaults to all months in meta)
     """
-    print("Sum of cpd & patent id dicts is:",
-          len(cpd_id_dict) + len(patent_id_dict))
+    num_cpds, num_patents = len(cpd_table["ids"]), len(patent_table["ids"])
+    print("Sum of cpd & patent id tables is:", num_cpds + num_patents)
     G = ig.Graph()
 
     #Add nodes
-    G.add_vertices(len(cpd_id_dict) + len(patent_id_dict))
-    G.vs["name"] = [*cpd_id_dict] + [*patent_id_dict]
+    G.add_vertices(num_cpds + num_patents)
+    G.vs["name"] = (id_interning.decode(cpd_table, np.arange(num_cpds)).tolist() +
+                    id_interning.decode(patent_table, np.arange(num_patents)).tolist())
     #Type is cpd/patent to distinguish bipartite nature of nodes
-    G.vs["type"] = [0] * len(cpd_id_dict) + [1] * len(patent_id_dict)
-
-    #Add edges
-    G.add_edges(edgelist)
+    G.vs["type"] = [0] * num_cpds + [1] * num_patents
+
+    patents, cpds = edgelist
+    if meta is not None:
+        #Sort edges by month (see temporal_bipartite.py)
+        edge_months, months = temporal_bipartite.edge_month_codes(meta, months)
+        T = temporal_bipartite.build_temporal_bipartite(patents, cpds, edge_months,
+                                                        months, num_cpds,
+                                                        num_patents)
+        patents, cpds = T["patents"], T["cpds"]
+
+        G["months"] = T["months"].tolist()
+        G["edge_offsets"] = T["edge_offsets"].tolist()
+
+    #Add edges - only one chunk of the mapped arrays is held in memory at a time
+    for start in range(0, len(patents), chunksize):
+        G.add_edges(
+            np.column_stack((patents[start:start + chunksize].astype(np.int64) +
+                             num_cpds, cpds[start:start + chunksize])))
 
     print(ig.summary(G))
 
     del (edgelist)
-    del (cpd_id_dict)
-    del (patent_id_dict)
 
     pickle.dump(G, file=open("../../../mnt/Archive/Shared/PatentData/SureChemBL/Graphs/cpd_patent_G.p", "wb"))
 
 
+def build_cumulative_cpd_network(months, fp, cpd_table_fp, out_fp,
+                                 checkpoint_every=12):
+    """ Builds the cumulative cpd-cpd network, adding one month of patents at a time
+
+    Keeps a running sparse adjacency of compound co-occurrence (number of shared patents
+    & the month each pair was first seen) and adds each month's patents to it as a delta,
+    instead of rebuilding every month's network from scratch. Cumulative snapshots are
+    checkpointed to out_fp every checkpoint_every months (and after the last month), and a
+    rerun resumes from the latest snapshot.
+
+    Note: pairs only co-occur within the month a patent's compounds were recorded - a
+    patent with rows in two months does not link compounds across them. Months with missing
+    or corrupted patent-cpd relations are skipped (as in replaceIds()).
+
+    Args:
+        months (list): months to accumulate, in order (YYYY-MM)
+        fp (string): filepath to CpdPatentIdsDates directory (patent-cpd relations)
+        cpd_table_fp (string): directory of the compound id table - rows of the adjacency
+            are compound id table indicies
+        out_fp (string): directory for snapshots (cpd_cpd_cumulative_<month>.npz)
+        checkpoint_every (int): number of months between snapshots
+
+    Returns:
+        C (scipy.sparse.csr_matrix): cumulative upper-triangular adjacency
+        first (scipy.sparse.csr_matrix): index (+1) into months of each pair's first month
+    """
+    cpd_table = id_interning.load_id_table(cpd_table_fp)
+    n_cpds = len(cpd_table["ids"])
+    os.makedirs(out_fp, exist_ok=True)
+
+    #Resume from the latest snapshot of a prefix of months
+    C = sparse.csr_matrix((n_cpds, n_cpds), dtype=np.int32)
+    first = sparse.csr_matrix((n_cpds, n_cpds), dtype=np.int32)
+    start = 0
+    for i in range(len(months) - 1, -1, -1):
+        snapshot_fp = os.path.join(out_fp,
+                                   "cpd_cpd_cumulative_" + months[i] + ".npz")
+        if os.path.isfile(snapshot_fp):
+            C, first, done = cpd_projection.load_cumulative_snapshot(snapshot_fp)
+            if done == months[:i + 1]:
+                print("Resuming after", months[i])
+                start = i + 1
+                break
+            C = sparse.csr_matrix((n_cpds, n_cpds), dtype=np.int32)
+            first = sparse.csr_matrix((n_cpds, n_cpds), dtype=np.int32)
+
+    for i in tqdm(range(start, len(months))):
+        #Missing or corrupted months add no edges, but keep their month code & checkpoint
+        try:
+            patents, offsets, cpds = load_patent_cpd_csr(fp, "_" + months[i])
+        except (EOFError, FileNotFoundError) as e:
+            print(months[i], "- skipped, no patent-cpd relations:", e)
+            patents = None
+
+        if patents is not None:
+            rows = np.repeat(np.arange(len(patents)), np.diff(offsets))
+            cols = id_interning.encode(cpd_table, cpds)
+            if (cols == -1).any():
+                print(months[i], "- cpds not in id table:", (cols == -1).sum())
+
+            B = cpd_projection.incidence_from_index(rows[cols != -1],
+                                                    cols[cols != -1], len(patents),
+                                                    n_cpds)
+            C, first = cpd_projection.accumulate_month(C, first, B, i)
+
+        if (i + 1) % checkpoint_every == 0 or i == len(months) - 1:
+            cpd_projection.save_cumulative_snapshot(
+                os.path.join(out_fp, "cpd_cpd_cumulative_" + months[i] + ".npz"),
+                C, first, months[:i + 1])
+
+    return C, first
+
+
+def apply_update(update, data_fp, store_fp, cpd_table_fp, patent_table_fp,
+                 edgelist_fp, chunksize=5000000,
+                 fp="../../../mnt/Archive/Shared/PatentData/SureChemBL/",
+                 relations_fp=None):
+    """ Incrementally adds one quarterly SureChemBL update to the network data
+
+    Only SureChEMBL_map_<update>.txt is read. Its months are written to the columnar store
+    as new parts (earlier updates' parts are untouched), newly seen compound & patent ids are
+    appended to the id tables, the update's edges are appended to the memory-mapped
+    bipartite edgelist, the CSR patent-cpd index of every month it touches
+    (patent_cpd_index_<month>.npz, read by replaceIds() & build_cumulative_cpd_network()) is
+    rebuilt from all of the month's parts in the store, and the master compound-month dataframe (Cpd_Data/master_cpd_date_df,
+    see get_bipartite_network_data.py) and its month index are updated. The update is then
+    recorded in the store's manifest - updates already in the manifest are skipped, and every
+    step can be rerun safely if an update was interrupted part-way.
+
+    Note: the legacy {id: index} dictionary pickles are not rewritten - build the bipartite
+    network from the id tables (see build_full_bipartite_network()). Months which an update
+    shares with earlier data must already be in the store (see get_cpd_patent_info(store_fp=...)),
+    otherwise their rebuilt CSR index only holds the update's rows. Networks built from these
+    files (replaceIds(), build_cumulative_cpd_network()) are not updated - rerun them for the
+    new months.
+
+    Args:
+        update (string): SureChemBL update, e.g. "20230101"
+        data_fp (string): filepath to SureChemBL mapping data (pre-downloaded)
+        store_fp (string): filepath to the root of the cpd_patent_store
+        cpd_table_fp (string): directory of the compound id table
+        patent_table_fp (string): directory of the patent id table
+        edgelist_fp (string): filepath prefix of the bipartite edgelist
+        chunksize (int): number of map rows held in memory while partitioning
+        fp (string): filepath to SureChemBL data (holding Cpd_Data/)
+        relations_fp (string): directory of the monthly patent-cpd relations (defaults to
+            CpdPatentIdsDates/Patent_Cpd_Edges/ in fp)
+
+    Returns:
+        dict: summary of the update, as recorded in the manifest
+    """
+    manifest = cpd_patent_store.load_manifest(store_fp)
+    if update in manifest["updates"]:
+        print("Update", update, "already applied")
+        return manifest["updates"][update]
+
+    import shutil
+    import tempfile
+
+    summary = {"months": [], "rows": 0, "new_cpds": 0, "new_patents": 0,
+               "new_first_seen_cpds": 0}
+
+    if relations_fp is None:
+        relations_fp = fp + "CpdPatentIdsDates/Patent_Cpd_Edges/"
+    os.makedirs(relations_fp, exist_ok=True)
+
+    seen_cpds, seen_months = [], []
+    os.makedirs(store_fp, exist_ok=True)
+    tmp_fp = tempfile.mkdtemp(prefix="map_partitions_", dir=store_fp)
+    try:
+        print("---- Partitioning SureChEMBL_map_" + update + ".txt ----")
+        months = partition_map_file(data_fp + "SureChEMBL_map_" + update + ".txt",
+                                    tmp_fp, chunksize)
+
+        for month in tqdm(months):
+            split = pd.read_csv(os.path.join(tmp_fp, month + ".txt"),
+                                delimiter="\t",
+                                names=["cpdID", "patentID", "Date"],
+                                dtype=str)
+
+            #New parts of the month's partitions
+            cpds, cpd_dates = get_ids_dates(split, "cpdID", {}, [])
+            patents, patent_dates = get_ids_dates(split, "patentID", {}, [])
+            cpd_patent_store.write_cpd_patent_month(split, cpd_dates,
+                                                    patent_dates, month,
+                                                    store_fp, part=update)
+
+            #CSR patent-cpd index of the whole month (all parts)
+            save_patent_cpd_index(
+                relations_fp, "_" + month,
+                *build_patent_cpd_index(
+                    cpd_patent_store.read_month("patent_cpd_edges", month,
+                                                store_fp)))
+
+            #Append newly seen ids, then translate the month's edges
+            summary["new_cpds"] += id_interning.append_ids(cpd_table_fp, cpds)
+            summary["new_patents"] += id_interning.append_ids(
+                patent_table_fp, patents)
+
+            cpd_table = id_interning.load_id_table(cpd_table_fp)
+            patent_table = id_interning.load_id_table(patent_table_fp)
+            append_bipartite_edges(
+                edgelist_fp, month + ":" + update,
+                id_interning.encode(patent_table, split["patentID"].values),
+                id_interning.encode(cpd_table, split["cpdID"].values))
+
+            seen_cpds.extend(cpds)
+            seen_months.extend([month] * len(cpds))
+            summary["months"].append(month)
+            summary["rows"] += len(split)
+    finally:
+        shutil.rmtree(tmp_fp)
+
+    #Master compound-month dataframe, then the igraph indicies & month index built from it
+    summary["new_first_seen_cpds"] = get_bipartite_network_data.merge_master_cpd_date(
+        seen_cpds, seen_months, fp)
+    get_bipartite_network_data.link_ids_cpds(fp, cpd_table_fp)
+    get_bipartite_network_data.build_cpd_month_index(fp)
+
+    cpd_patent_store.record_update(update, summary, store_fp)
+    print("Applied", update, summary["rows"], "rows,", summary["new_cpds"],
+          "new cpds,", summary["new_patents"], "new patents")
+
+    return summary
+
+
 def main():
     ### Read in data ###
 
@@ -614,6 +1572,20 @@ def main():
 
     updates = build_month_list(1976, 2022)
 
+    ### Cumulative cpd-cpd network ###
+    # C, first = build_cumulative_cpd_network(
+    #     updates, "../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/",
+    #     "../../../mnt/Archive/Shared/PatentData/SureChemBL/Cpd_Data/cpd_ID_table/",
+    #     "../../../mnt/Archive/Shared/PatentData/SureChemBL/Graphs/Cumulative/")
+
+    ### Incremental quarterly updates ###
+    # apply_update("20230101",
+    #              "../../../mnt/Archive/Shared/PatentData/SureChemBL/SureChemblMAP/",
+    #              "../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentStore/",
+    #              "../../../mnt/Archive/Shared/PatentData/SureChemBL/Cpd_Data/cpd_ID_table/",
+    #              "../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/patent_ID_table/",
+    #              "../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/index_edgelist_bipartite")
+
     # for update in ["2021-06"]: #updates:
     #     # ## Moves data to scratch on Agave
 
@@ -720,7 +1692,14 @@ def main():
     build_patent_ID_mapping(updates, fp)
 
     #Step 2: Update patent-cpd-id files to include patent ids
-    #Load cpd-id dictionary - should only be run once
+    #Load cpd & patent id tables
+    cpd_table = id_interning.load_id_table(
+        "../../../mnt/Archive/Shared/PatentData/SureChemBL/Cpd_Data/cpd_ID_table/")
+    patent_table = id_interning.load_id_table(
+        "../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/patent_ID_table/")
+
+    replaceIds(updates, fp, cpd_table, patent_table)
+
     cpd_id_dict = pickle.load(file=open(
         "../../../mnt/Archive/Shared/PatentData/SureChemBL/Cpd_Data/cpd_ID_index_dict.p",
         "rb"))
@@ -728,17 +1707,13 @@ def main():
         "../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/patent_ID_index_dict.p",
         "rb"))
 
-    print("Num Cpds:", len(cpd_id_dict))
-    print("Patents", len(patent_id_dict))
-
-    replaceIds(updates, fp, cpd_id_dict, patent_id_dict)
-
     # #Step 3: Make edgelist of patent-cpd edges, using igraph ids - should only be run once
     edgelist = build_bipartite_edgelist(updates, fp)
 
     # Step 4: Build & save full igraph network
-    # edgelist = pickle.load(
-    #     file=open("/scratch/jmalloy3/Patents/index_edgelist_bipartite.p", "rb"))
+    # patents, cpds, meta = load_bipartite_edges(
+    #     "../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/index_edgelist_bipartite")
+    # edgelist = (patents, cpds)
 
     # #GDrive filepath
     # cpd_id_dict = pickle.load(file=open("G:/Shared drives/SureChemBL_Patents/Cpd_Data/cpd_ID_index_dict.p", "rb"))
@@ -747,7 +1722,7 @@ def main():
     print("Num cpds:", len(cpd_id_dict))
     print("Num patents:", len(patent_id_dict))
 
-    # build_full_bipartite_network(edgelist, cpd_id_dict, patent_id_dict)
+    # build_full_bipartite_network(edgelist, cpd_table, patent_table, meta=meta)
     #
     # Step 5: Add cpd names & patent ids
 
@@ -0,0 +1,170 @@
+""" Tracks connected components of a growing network month by month
+
+Networks only gain vertices & edges over time, so components only ever merge. Instead of
+computing G.clusters() from scratch for every month, edges are replayed in month order
+into a disjoint-set (union-find) structure over integer vertex ids, and component
+statistics are read off at every month boundary.
+
+The union-find is kept flat (every vertex points straight at the root of its component),
+so finding roots is one numpy gather. Each month's new edges are merged in bulk: the roots
+they join are grouped with scipy's connected_components, and the parent array is
+relabelled once per month.
+
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
+from tqdm import tqdm
+
+
+def merge_edges(parent, size, src, dst, root_map):
+    """ Merges the components joined by a block of edges
+
+    Args:
+        parent (numpy array): root of every vertex (updated in place)
+        size (numpy array): size of every component, indexed by root (updated in place)
+        src, dst (numpy arrays): edge endpoints
+        root_map (numpy array): identity array (np.arange(len(parent))), used as scratch
+            space and restored before returning
+
+    Returns:
+        int: number of merges (components removed)
+    """
+    ru = parent[src]
+    rv = parent[dst]
+    joins = ru != rv
+    if not joins.any():
+        return 0
+
+    #Components (of roots) formed by the new edges
+    roots = np.unique(np.concatenate([ru[joins], rv[joins]]))
+    A = sparse.coo_matrix(
+        (np.ones(joins.sum(), dtype=bool),
+         (np.searchsorted(roots, ru[joins]), np.searchsorted(roots, rv[joins]))),
+        shape=(len(roots), len(roots)))
+    n_components, labels = csgraph.connected_components(A, directed=False)
+
+    #The smallest root of each group becomes the new root
+    new_roots = np.full(n_components, len(parent), dtype=roots.dtype)
+    np.minimum.at(new_roots, labels, roots)
+    new_sizes = np.bincount(labels, weights=size[roots]).astype(size.dtype)
+    size[roots] = 0
+    size[new_roots] = new_sizes
+
+    root_map[roots] = new_roots[labels]
+    parent[:] = root_map[parent]
+    root_map[roots] = roots
+
+    return len(roots) - n_components
+
+
+def track_components(src, dst, edge_offsets, months, n_vertices,
+                     vertex_month=None, lcc_fp=None):
+    """ Replays edges in month order, recording component statistics at every month boundary
+
+    Args:
+        src, dst (array-like): edge endpoints (integer vertex ids), sorted by month
+        edge_offsets (numpy array): edges of month k are edges[edge_offsets[k]:edge_offsets[k + 1]]
+        months (list): months (YYYY-MM), in order
+        n_vertices (int): number of vertices
+        vertex_month (numpy array): index of the month each vertex appears (-1 if never) -
+            defaults to the month of its first edge
+        lcc_fp (string): if given, saves the membership of the largest connected component
+            of every month as a bitmask (see save_lcc_membership())
+
+    Returns:
+        pandas dataframe: "Month", "Nodes", "Components" & "LCC Size" of every month
+        histograms (dict): links each month to (sizes, counts) arrays of its component sizes
+    """
+    if vertex_month is None:
+        vertex_month = np.full(n_vertices, len(months), dtype=np.int64)
+        edge_months = np.repeat(np.arange(len(months)), np.diff(edge_offsets))
+        np.minimum.at(vertex_month, np.asarray(src), edge_months)
+        np.minimum.at(vertex_month, np.asarray(dst), edge_months)
+        vertex_month[vertex_month == len(months)] = -1
+
+    parent = np.arange(n_vertices, dtype=np.int64)
+    root_map = np.arange(n_vertices, dtype=np.int64)
+    size = np.ones(n_vertices, dtype=np.int64)
+
+    data = []
+    histograms = {}
+    for k, month in enumerate(tqdm(months)):
+        start, end = edge_offsets[k], edge_offsets[k + 1]
+        merge_edges(parent, size, np.asarray(src[start:end]),
+                    np.asarray(dst[start:end]), root_map)
+
+        present = (vertex_month >= 0) & (vertex_month <= k)
+        roots = np.flatnonzero(present & (parent == root_map))
+        sizes = size[roots]
+        histograms[month] = np.unique(sizes, return_counts=True)
+
+        lcc_size = 0
+        if len(roots):
+            lcc_size = int(sizes.max())
+            if lcc_fp is not None:
+                save_lcc_membership(lcc_fp, month,
+                                    parent == roots[np.argmax(sizes)])
+
+        data.append({
+            "Month": month,
+            "Nodes": int(present.sum()),
+            "Components": len(roots),
+            "LCC Size": lcc_size,
+        })
+
+    return pd.DataFrame(data), histograms
+
+
+def save_lcc_membership(fp, month, members):
+    """ Saves membership of the largest connected component as a bitmask (1 bit per vertex)
+
+    Args:
+        fp (string): directory to save to (lcc_<month>.npy)
+        month (string): month, in the form YYYY-MM
+        members (numpy array): boolean mask over vertex ids
+
+    Returns:
+        None
+    """
+    os.makedirs(fp, exist_ok=True)
+    np.save(os.path.join(fp, "lcc_" + month + ".npy"), np.packbits(members))
+
+
+def load_lcc_membership(fp, month, n_vertices):
+    """ Loads a bitmask saved by save_lcc_membership()
+
+    Args:
+        fp (string): directory holding the bitmasks
+        month (string): month, in the form YYYY-MM
+        n_vertices (int): number of vertices
+
+    Returns:
+        numpy array: vertex ids in the largest connected component
+    """
+    bits = np.load(os.path.join(fp, "lcc_" + month + ".npy"))
+
+    return np.flatnonzero(np.unpackbits(bits, count=n_vertices))
+
+
+def track_temporal_bipartite(T, lcc_fp=None):
+    """ Tracks components of the temporal cpd-patent network (see temporal_bipartite.py)
+
+    Vertex ids are compound id table indicies, followed by patent id table indicies offset
+    by the number of compounds.
+
+    Args:
+        T (dict): temporal network
+        lcc_fp (string): optional directory for monthly LCC bitmasks
+
+    Returns:
+        see track_components()
+    """
+    return track_components(T["cpds"],
+                            np.asarray(T["patents"], dtype=np.int64) + T["n_cpds"],
+                            T["edge_offsets"], T["months"].tolist(),
+                            T["n_cpds"] + T["n_patents"], T["vertex_month"],
+                            lcc_fp)
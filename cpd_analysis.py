@@ -1,5 +1,5 @@
 # import igraph as ig
-# import numpy as np
+import numpy as np
 import pickle
 import pandas as pd
 from tqdm import tqdm
@@ -7,6 +7,7 @@ import os
 import heapq
 import scipy.stats as stats
 from random import sample
+import cpd_patent_store
 
 
 def build_cpd_df(fp):
@@ -30,6 +31,28 @@ def build_cpd_df(fp):
     del df
 
 
+def load_full_id_degrees(fp):
+    """ Loads cumulative compound degrees saved by get_cpd_network_data.calculate_preferential_attachment()
+
+    Reads the full_id_degrees_*.npz arrays, or the legacy full_id_degrees_*.p dictionary of
+    id:[cumulative degrees] lists if no .npz exists.
+
+    Args:
+        fp (string): filepath of the saved degrees, without extension
+
+    Returns:
+        cpd_rows (pandas index): SureChemBL ids, in the row order of cumulative
+        cumulative (numpy array): (compounds x updates) cumulative degrees
+    """
+    if os.path.isfile(fp + ".npz"):
+        with np.load(fp + ".npz") as data:
+            return pd.Index(data["ids"]), data["cumulative"]
+
+    full_id_degrees = pickle.load(file=open(fp + ".p", "rb"))
+    return pd.Index(list(full_id_degrees.keys())), np.array(
+        list(full_id_degrees.values()))
+
+
 def find_highest_degrees(df, n, start, stop):
     """ Finds the n highest-degree compounds within a specific date range
 
@@ -45,17 +68,16 @@ def find_highest_degrees(df, n, start, stop):
     print("----------", start, stop, "----------")
 
     #Finding the top 10 preferential attachment compounds (from 1980-1984 as a test)
-    full_id_degrees = pickle.load(file=open(
+    cpd_rows, cumulative = load_full_id_degrees(
         "G:\\Shared drives\\SureChemBL_Patents\\Degrees\\full_id_degrees_" +
-        str(start) + "_" + str(stop) + ".p", "rb"))
+        str(start) + "_" + str(stop))
     pref_attach_dict = pickle.load(file=open(
         "G:\\Shared drives\\SureChemBL_Patents\\pref_attach_dict_" +
         str(start) + "_" + str(stop) + ".p", "rb"))
 
-    #Find n compounds with largest degree
-    highest_degree_cpds = heapq.nlargest(n,
-                                         full_id_degrees,
-                                         key=full_id_degrees.get)
+    #Find n compounds with largest degree - ordered by their lists of cumulative degrees, as
+    #heapq.nlargest(n, full_id_degrees, key=full_id_degrees.get) on the legacy dictionary
+    highest_degree_cpds = cpd_rows[np.lexsort((-cumulative).T[::-1])[:n]]
 
     highest_degree_cpds_df = df[df["SureChEMBL_ID"].isin(highest_degree_cpds)]
 
@@ -68,7 +90,7 @@ def find_highest_degrees(df, n, start, stop):
 
     for cpd in tqdm(highest_degree_cpds_df["SureChEMBL_ID"]):
         #Degree of compound
-        degrees.append(full_id_degrees[cpd][-1])
+        degrees.append(cumulative[cpd_rows.get_loc(cpd), -1])
 
         #Preferential attachment value
         pref_attach_highestCpd_values.append(pref_attach_dict[cpd])
@@ -130,9 +152,8 @@ def find_llanos_cpds(fp, df):
     }
 
     #Find stats for Llanos compounds - use 2015 data for stats (I really need to make a consensus graph)
-    full_id_degrees = pickle.load(file=open(
-        "G:\\Shared drives\\SureChemBL_Patents\\Degrees\\full_id_degrees_2015_2019.p",
-        "rb"))
+    cpd_rows, cumulative = load_full_id_degrees(
+        "G:\\Shared drives\\SureChemBL_Patents\\Degrees\\full_id_degrees_2015_2019")
     pref_attach_dict = pickle.load(file=open(
         "G:\\Shared drives\\SureChemBL_Patents\\pref_attach_dict_2015_2019.p",
         "rb"))
@@ -147,7 +168,7 @@ def find_llanos_cpds(fp, df):
             s = df[df["InChI"] == inchi]
             if not s.empty:  #if SureChemBL holds that compound, save id & stats
                 #Degree of compound
-                degree = full_id_degrees[s.iloc[0]["SureChEMBL_ID"]][-1]
+                degree = cumulative[cpd_rows.get_loc(s.iloc[0]["SureChEMBL_ID"]), -1]
 
                 #Preferential attachment value
                 pref_attach_value = pref_attach_dict[s.iloc[0]["SureChEMBL_ID"]]
@@ -238,10 +259,15 @@ def sample_compounds(n, months, cpd_df):
     sample_inchis = {}
     sample_ids = {}
 
-    fp = "/Volumes/Macintosh HD 4/SureChemBL/CpdPatentIdsDates/Unique_Cpds/"
+    # fp = "/Volumes/Macintosh HD 4/SureChemBL/CpdPatentIdsDates/Unique_Cpds/"
+    #Unique compounds of each month - from the cpd_patent_store, or the legacy pickles
+    store_fp = "/Volumes/Macintosh HD 4/SureChemBL/CpdPatentStore/"
+    pickle_fp = "/Volumes/Macintosh HD 4/SureChemBL/CpdPatentIdsDates/"
     print("----- Sampling Full Compounds ------\n")
     for month in tqdm(months):
-        cpds = pickle.load(file=open(fp + "unique_cpds_" + month + ".p", "rb"))
+        cpds = cpd_patent_store.read_month("cpd_dates", month, store_fp,
+                                           columns=["cpdID"],
+                                           pickle_fp=pickle_fp)["cpdID"].unique().tolist()
 
         sample_cpds = sample(cpds, n)
 
@@ -258,7 +284,13 @@ def sample_compounds(n, months, cpd_df):
 def count_unique_cpds(months):
     all_cpds = []
     for month in months:
-        unique_cpds = pickle.load(open(f"/../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/Unique_Cpds/unique_cpds_{month}.p", "rb"))
+        # unique_cpds = pickle.load(open(f"/../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/Unique_Cpds/unique_cpds_{month}.p", "rb"))
+        unique_cpds = cpd_patent_store.read_month(
+            "cpd_dates", month,
+            "/../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentStore/",
+            columns=["cpdID"],
+            pickle_fp="/../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/"
+        )["cpdID"].unique().tolist()
         all_cpds = list(set(all_cpds + unique_cpds))
         
     print(f"Total cpds: {len(all_cpds)}")
@@ -0,0 +1,320 @@
+""" Columnar, month-partitioned storage of SureChemBL compound & patent data
+
+Replaces the per-month pickles in CpdPatentIdsDates (unique_cpds_<month>.p,
+cpd_date_dict_<month>.p, patent_cpd_edges_<month>.p, ...) with Parquet datasets,
+one per table, partitioned by month in hive layout:
+
+    <fp>/<table>/month=YYYY-MM/part-<part>.parquet
+
+Partitions written in one go use part "0"; incremental updates (see
+build_network.apply_update()) add one part per SureChemBL update. The store also
+holds manifest.json (updates applied so far).
+
+Tables (all columns are strings):
+    cpd_dates: cpdID, Date - earliest date of each compound within the month
+    patent_dates: patentID, Date - earliest date of each patent within the month
+    cpd_patent_edges: cpdID, patentID - deduplicated cpd-patent relations
+    patent_cpd_edges: patentID, cpdID - every cpd-patent row, grouped by patent
+
+Readers only open the partitions (months) and columns that are asked for. read_month()
+(and read_id_date_dict()) can fall back to the legacy pickles for months which are not in
+the store.
+
+"""
+
+import os
+import json
+import pickle
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+TABLES = {
+    "cpd_dates": ["cpdID", "Date"],
+    "patent_dates": ["patentID", "Date"],
+    "cpd_patent_edges": ["cpdID", "patentID"],
+    "patent_cpd_edges": ["patentID", "cpdID"],
+}
+
+PARTITIONING = ds.partitioning(pa.schema([("month", pa.string())]),
+                               flavor="hive")
+
+
+def write_month(df, table, month, fp, part="0"):
+    """ Writes one month of a table to the store, replacing any existing file of the same part
+
+    Args:
+        df (pandas dataframe): data with the columns listed in TABLES[table]
+        table (string): name of the table (see TABLES)
+        month (string): month, in the form YYYY-MM
+        fp (string): filepath to the root of the store
+        part (string): name of the file within the month partition - incremental updates
+            write one part per SureChemBL update, so earlier parts are left untouched
+
+    Returns:
+        None, but writes <fp>/<table>/month=<month>/part-<part>.parquet
+    """
+    partition_fp = os.path.join(fp, table, "month=" + month)
+    os.makedirs(partition_fp, exist_ok=True)
+
+    columns = TABLES[table]
+    data = pa.Table.from_pandas(df[columns],
+                                schema=pa.schema([(c, pa.string()) for c in columns]),
+                                preserve_index=False)
+    pq.write_table(data, os.path.join(partition_fp, "part-" + part + ".parquet"))
+
+
+def write_cpd_patent_month(split, cpd_dates, patent_dates, month, fp, part="0"):
+    """ Writes all tables for one month of SureChemBL map data
+
+    Args:
+        split (pandas dataframe): map data of one month (cpdID, patentID, Date)
+        cpd_dates (dict): earliest date of each compound in the month
+        patent_dates (dict): earliest date of each patent in the month
+        month (string): month, in the form YYYY-MM
+        fp (string): filepath to the root of the store
+        part (string): name of the file within each month partition (see write_month())
+
+    Returns:
+        None, but writes a partition of every table in TABLES
+    """
+    write_month(pd.DataFrame(cpd_dates.items(), columns=["cpdID", "Date"]),
+                "cpd_dates", month, fp, part)
+    write_month(pd.DataFrame(patent_dates.items(), columns=["patentID", "Date"]),
+                "patent_dates", month, fp, part)
+    write_month(split[["cpdID", "patentID"]].drop_duplicates(),
+                "cpd_patent_edges", month, fp, part)
+
+    #Stable sort keeps the compounds of each patent in row order (as in the legacy dictionary)
+    write_month(split.sort_values(by="patentID", kind="stable"),
+                "patent_cpd_edges", month, fp, part)
+
+
+def get_months(table, fp):
+    """ Lists the months present in a table
+
+    Args:
+        table (string): name of the table (see TABLES)
+        fp (string): filepath to the root of the store
+
+    Returns:
+        list: sorted months (YYYY-MM)
+    """
+    table_fp = os.path.join(fp, table)
+    if not os.path.isdir(table_fp):
+        return []
+
+    return sorted(d[len("month="):] for d in os.listdir(table_fp)
+                  if d.startswith("month="))
+
+
+def read_table(table, fp, columns=None, start=None, stop=None, isin=None):
+    """ Reads a table from the store
+
+    Only partitions with start <= month <= stop are opened, and only the requested
+    columns are read from them.
+
+    Args:
+        table (string): name of the table (see TABLES)
+        fp (string): filepath to the root of the store
+        columns (list): columns to read - "month" may be included (defaults to all
+            columns of the table)
+        start (string): first month to read, in the form YYYY-MM (inclusive)
+        stop (string): last month to read, in the form YYYY-MM (inclusive)
+        isin (dict): optional row filter, linking a column to the values to keep,
+            e.g. {"patentID": patents}
+
+    Returns:
+        pandas dataframe with the requested columns
+    """
+    if columns is None:
+        columns = TABLES[table]
+
+    dataset = ds.dataset(os.path.join(fp, table),
+                         format="parquet",
+                         partitioning=PARTITIONING)
+
+    expression = None
+    if start is not None:
+        expression = ds.field("month") >= start
+    if stop is not None:
+        expression = ds.field("month") <= stop if expression is None else \
+            expression & (ds.field("month") <= stop)
+    for column, values in (isin or {}).items():
+        f = ds.field(column).isin(list(values))
+        expression = f if expression is None else expression & f
+
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+#Legacy pickle of each table, in the CpdPatentIdsDates directory layout
+PICKLES = {
+    "cpd_dates": "Cpd_Date_Dict/cpd_date_dict_",
+    "patent_dates": "Patent_Date_Dict/patent_date_dict_",
+    "cpd_patent_edges": "Cpd_Patent_Edges/cpd_patent_edges_",
+    "patent_cpd_edges": "Patent_Cpd_Edges/patent_cpd_edges_",
+}
+
+
+def has_month(table, month, fp):
+    """ Checks whether a month of a table is in the store
+
+    Args:
+        table (string): name of the table (see TABLES)
+        month (string): month, in the form YYYY-MM
+        fp (string): filepath to the root of the store
+
+    Returns:
+        bool
+    """
+    return os.path.isdir(os.path.join(fp, table, "month=" + month))
+
+
+def read_pickle_month(table, month, pickle_fp):
+    """ Reads one month of a table from the legacy per-month pickles
+
+    Args:
+        table (string): name of the table (see TABLES)
+        month (string): month, in the form YYYY-MM
+        pickle_fp (string): filepath to CpdPatentIdsDates directory (see PICKLES)
+
+    Returns:
+        pandas dataframe with the columns of the table
+    """
+    data = pickle.load(file=open(pickle_fp + PICKLES[table] + month + ".p", "rb"))
+
+    if table == "patent_cpd_edges":
+        data = [(p, c) for p, cpds in data.items() for c in cpds]
+    elif table != "cpd_patent_edges":
+        data = list(data.items())
+
+    return pd.DataFrame(data, columns=TABLES[table], dtype=str)
+
+
+def read_month(table, month, fp, columns=None, pickle_fp=None):
+    """ Reads a single month of a table from the store
+
+    Args:
+        table (string): name of the table (see TABLES)
+        month (string): month, in the form YYYY-MM
+        fp (string): filepath to the root of the store
+        columns (list): columns to read (defaults to all columns of the table)
+        pickle_fp (string): if given, months which are not in the store are read from the
+            legacy pickles in this CpdPatentIdsDates directory (see read_pickle_month())
+
+    Returns:
+        pandas dataframe with the requested columns
+    """
+    if pickle_fp is not None and not has_month(table, month, fp):
+        return read_pickle_month(table, month, pickle_fp)[columns or TABLES[table]]
+
+    return read_table(table, fp, columns=columns, start=month, stop=month)
+
+
+def read_part(table, month, part, fp, columns=None):
+    """ Reads a single part file (e.g. one SureChemBL update) of a month partition
+
+    Args:
+        table (string): name of the table (see TABLES)
+        month (string): month, in the form YYYY-MM
+        part (string): name of the part (see write_month())
+        fp (string): filepath to the root of the store
+        columns (list): columns to read (defaults to all columns of the table)
+
+    Returns:
+        pandas dataframe with the requested columns
+    """
+    return pq.read_table(os.path.join(fp, table, "month=" + month,
+                                      "part-" + part + ".parquet"),
+                         columns=columns or TABLES[table]).to_pandas()
+
+
+def read_id_date_dict(table, month, fp, pickle_fp=None):
+    """ Reads one month of a date table as the legacy {id: date} dictionary
+
+    If the month has several parts (from incremental updates), the earliest date is kept.
+
+    Args:
+        table (string): "cpd_dates" or "patent_dates"
+        month (string): month, in the form YYYY-MM
+        fp (string): filepath to the root of the store
+        pickle_fp (string): fallback for months not in the store (see read_month())
+
+    Returns:
+        dict: links each id with its earliest date in the month
+    """
+    df = read_month(table, month, fp, pickle_fp=pickle_fp)
+    df = df.sort_values(by="Date", kind="stable").drop_duplicates(
+        subset=TABLES[table][0])
+    return dict(zip(df[TABLES[table][0]], df["Date"]))
+
+
+def convert_pickles(months, pickle_fp, fp):
+    """ Converts existing per-month pickles in CpdPatentIdsDates into the store
+
+    Expects the directory layout of CpdPatentIdsDates (Cpd_Date_Dict/, Patent_Date_Dict/,
+    Cpd_Patent_Edges/ and Patent_Cpd_Edges/ subdirectories). Missing or truncated pickles
+    are skipped.
+
+    Args:
+        months (list): months to convert, in the form YYYY-MM
+        pickle_fp (string): filepath to CpdPatentIdsDates directory
+        fp (string): filepath to the root of the store
+
+    Returns:
+        list: months which could not be (fully) converted
+    """
+    failed = []
+    for month in tqdm(months):
+        try:
+            frames = {
+                table: read_pickle_month(table, month, pickle_fp)
+                for table in TABLES
+            }
+        except (FileNotFoundError, EOFError):
+            failed.append(month)
+            continue
+
+        for table, df in frames.items():
+            write_month(df, table, month, fp)
+
+    return failed
+
+
+def load_manifest(fp):
+    """ Loads the manifest of SureChemBL updates applied to the store
+
+    Args:
+        fp (string): filepath to the root of the store
+
+    Returns:
+        dict: {"updates": {update: summary}} - empty if nothing has been applied
+    """
+    if not os.path.isfile(os.path.join(fp, "manifest.json")):
+        return {"updates": {}}
+
+    with open(os.path.join(fp, "manifest.json")) as f:
+        return json.load(f)
+
+
+def record_update(update, summary, fp):
+    """ Records a fully applied SureChemBL update in the manifest
+
+    Args:
+        update (string): SureChemBL update (e.g., "20230101")
+        summary (dict): description of what the update added
+        fp (string): filepath to the root of the store
+
+    Returns:
+        None, but rewrites <fp>/manifest.json
+    """
+    manifest = load_manifest(fp)
+    manifest["updates"][update] = summary
+
+    with open(os.path.join(fp, "manifest.tmp.json"), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(os.path.join(fp, "manifest.tmp.json"),
+               os.path.join(fp, "manifest.json"))
@@ -0,0 +1,375 @@
+""" Projects the cpd-patent bipartite network onto compounds using sparse matrices
+
+Two compounds are linked if they appear in the same patent. Instead of expanding
+every patent into all itertools.combinations of its compounds (see
+build_network.build_cpd_network()), the compound-compound network is computed as
+the sparse matrix product B^T B, where B is the (patents x compounds) incidence
+matrix. Entry (i, j) of the product is the number of patents shared by compounds
+i and j, and only the upper triangle (i < j) is kept, so every compound pair
+appears once.
+
+"""
+
+import time
+import numpy as np
+import pandas as pd
+import igraph as ig
+from itertools import chain
+from scipy import sparse
+
+
+def build_incidence_matrix(cpds, patent_cpd_links):
+    """ Builds the binary (patents x compounds) incidence matrix
+
+    Args:
+        cpds (list): all unique compound ids - column i of the matrix is cpds[i]
+        patent_cpd_links (dict): links each patent to the compounds found in it
+
+    Returns:
+        scipy.sparse.csr_matrix: len(patent_cpd_links) x len(cpds) matrix, 1 where a
+        compound appears in a patent (repeats within a patent are counted once)
+    """
+    lengths = [len(s) for s in patent_cpd_links.values()]
+    cols = pd.Index(cpds).get_indexer(
+        list(chain.from_iterable(patent_cpd_links.values())))
+    if (cols == -1).any():
+        raise ValueError("Patents contain cpds which are not in cpds")
+
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+
+    return incidence_from_index(rows, cols, len(lengths), len(cpds))
+
+
+def incidence_from_index(rows, cols, n_patents, n_cpds):
+    """ Builds the binary incidence matrix from integer (patent, compound) pairs
+
+    Args:
+        rows (numpy array): patent row of every pair
+        cols (numpy array): compound column of every pair
+        n_patents (int): number of patents (rows)
+        n_cpds (int): number of compounds (columns)
+
+    Returns:
+        scipy.sparse.csr_matrix: n_patents x n_cpds binary matrix
+    """
+    B = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                          shape=(n_patents, n_cpds))
+    B.sum_duplicates()
+    B.data[:] = 1
+
+    return B
+
+
+def project_cpd_cpd(B):
+    """ Projects an incidence matrix onto compounds
+
+    Args:
+        B (scipy.sparse matrix): binary (patents x compounds) incidence matrix
+
+    Returns:
+        scipy.sparse.csr_matrix: upper-triangular (compounds x compounds) adjacency, where
+        entry (i, j), i < j, is the number of patents compounds i & j share
+    """
+    B = sparse.csr_matrix(B)
+
+    return sparse.triu(B.T @ B, k=1, format="csr")
+
+
+def apply_hub_policy(patent_cpd_links, threshold, policy, seed=0):
+    """ Limits the compound pairs contributed by patents with very many compounds
+
+    A patent with n (unique) compounds contributes n(n-1)/2 pairs, so a handful of giant
+    patents can dominate the cpd-cpd network. Patents with more than threshold compounds
+    are handled by policy:
+        "skip": the patent is dropped
+        "sample": threshold of its compounds are sampled at random and fully connected
+        "star": its first compound is connected to each other compound (n - 1 pairs)
+
+    Args:
+        patent_cpd_links (dict): links each patent to the compounds found in it
+        threshold (int): largest number of compounds a patent may have before the policy
+            applies
+        policy (string): "skip", "sample", or "star"
+        seed (int): random seed (for "sample")
+
+    Returns:
+        links (dict): patent_cpd_links without hub patents ("skip" & "star") or with sampled
+            compounds ("sample")
+        star_pairs (list): (cpd, cpd) pairs from star-connected hub patents
+        report (dict): number of hub patents, and pairs (one per patent per compound pair)
+            before & after the policy
+    """
+    if policy not in ["skip", "sample", "star"]:
+        raise ValueError("Unknown hub policy: " + str(policy))
+
+    rng = np.random.default_rng(seed)
+    links = {}
+    star_pairs = []
+    report = {"policy": policy, "threshold": threshold, "hub_patents": 0,
+              "hub_pairs": 0, "hub_pairs_kept": 0}
+
+    for patent, patent_cpds in patent_cpd_links.items():
+        unique_cpds = list(dict.fromkeys(patent_cpds))
+        n = len(unique_cpds)
+        if n <= threshold:
+            links[patent] = patent_cpds
+            continue
+
+        report["hub_patents"] += 1
+        report["hub_pairs"] += n * (n - 1) // 2
+
+        if policy == "sample":
+            links[patent] = list(rng.choice(unique_cpds, threshold, replace=False))
+            report["hub_pairs_kept"] += threshold * (threshold - 1) // 2
+        elif policy == "star":
+            star_pairs.extend((unique_cpds[0], c) for c in unique_cpds[1:])
+            report["hub_pairs_kept"] += n - 1
+
+    report["hub_pairs_dropped"] = report["hub_pairs"] - report["hub_pairs_kept"]
+
+    return links, star_pairs, report
+
+
+def project_with_hub_policy(cpds, patent_cpd_links, threshold, policy, seed=0):
+    """ Projects patents onto compounds, applying a hub policy to large patents
+
+    Args:
+        cpds (list): all unique compound ids
+        patent_cpd_links (dict): links each patent to the compounds found in it
+        threshold (int): see apply_hub_policy()
+        policy (string): see apply_hub_policy()
+        seed (int): random seed (for "sample")
+
+    Returns:
+        C (scipy.sparse.csr_matrix): upper-triangular adjacency (see project_cpd_cpd())
+        report (dict): see apply_hub_policy()
+    """
+    links, star_pairs, report = apply_hub_policy(patent_cpd_links, threshold,
+                                                 policy, seed)
+    C = project_cpd_cpd(build_incidence_matrix(cpds, links))
+
+    if star_pairs:
+        ends = pd.Index(cpds).get_indexer(list(chain.from_iterable(star_pairs)))
+        ends = ends.reshape(-1, 2)
+        C = C + sparse.csr_matrix(
+            (np.ones(len(ends), dtype=C.dtype),
+             (ends.min(axis=1), ends.max(axis=1))), shape=C.shape)
+
+    print("Hub patents:", report["hub_patents"], "- pairs dropped:",
+          report["hub_pairs_dropped"], "of", report["hub_pairs"])
+
+    return C.tocsr(), report
+
+
+def first_cooccurrence_dates(B, patent_dates):
+    """ Finds the earliest date on which each pair of compounds appears in a shared patent
+
+    Patents are grouped by date and projected in date order; a pair's first date is the first
+    group in which it appears. This takes one sparse product per distinct date (at most ~31
+    for a month of SureChemBL data).
+
+    Args:
+        B (scipy.sparse matrix): binary (patents x compounds) incidence matrix
+        patent_dates (list): date of every patent (row of B), as YYYY-MM-DD strings
+
+    Returns:
+        scipy.sparse.csr_matrix: upper-triangular matrix with the same pattern as
+        project_cpd_cpd(B), holding the index (+1) of each pair's first date in dates
+        dates (numpy array): sorted distinct dates
+    """
+    B = sparse.csr_matrix(B)
+    dates, codes = np.unique(np.asarray(patent_dates, dtype=str),
+                             return_inverse=True)
+
+    seen = sparse.csr_matrix((B.shape[1], B.shape[1]), dtype=bool)
+    first = sparse.csr_matrix((B.shape[1], B.shape[1]), dtype=np.int32)
+    for code in range(len(dates)):
+        C = project_cpd_cpd(B[codes == code]).astype(bool)
+        new = C > seen  #pairs not seen on any earlier date
+        first = first + new.astype(np.int32) * (code + 1)
+        seen = seen + C
+
+    return first.tocsr(), dates
+
+
+def accumulate_month(C, first, B, code):
+    """ Adds one month of patents to a cumulative compound adjacency
+
+    Args:
+        C (scipy.sparse matrix): cumulative upper-triangular adjacency (shared patent counts)
+        first (scipy.sparse matrix): index (+1) of the month each pair was first seen, with
+            the same pattern as C
+        B (scipy.sparse matrix): binary incidence matrix of the month's patents - may have
+            more columns than C if new compounds were added to the id table
+        code (int): index of the month (stored as code + 1 in first)
+
+    Returns:
+        C, first: updated cumulative matrices (csr)
+    """
+    n = B.shape[1]
+    if C.shape[0] < n:
+        C = sparse.csr_matrix(C)
+        first = sparse.csr_matrix(first)
+        C.resize((n, n))
+        first.resize((n, n))
+
+    C_month = project_cpd_cpd(B)
+    new = C_month.astype(bool) > C.astype(bool)  #pairs not seen in any earlier month
+
+    return (C + C_month).tocsr(), (first + new.astype(np.int32) * (code + 1)).tocsr()
+
+
+def save_cumulative_snapshot(fp, C, first, months):
+    """ Saves a cumulative compound adjacency (see accumulate_month())
+
+    Args:
+        fp (string): filepath of the .npz file
+        C (scipy.sparse matrix): cumulative adjacency
+        first (scipy.sparse matrix): first month codes of every pair
+        months (list): months accumulated so far, in order (YYYY-MM)
+
+    Returns:
+        None, but saves C & first as (row, col, weight, first) arrays
+    """
+    C = sparse.coo_matrix(C)
+    codes = np.asarray(sparse.csr_matrix(first)[C.row, C.col]).ravel()
+
+    np.savez(fp,
+             row=C.row.astype(np.int32),
+             col=C.col.astype(np.int32),
+             weight=C.data.astype(np.int32),
+             first=codes.astype(np.int16),
+             months=np.asarray(months, dtype=str),
+             shape=np.asarray(C.shape))
+
+
+def load_cumulative_snapshot(fp):
+    """ Loads a cumulative compound adjacency saved by save_cumulative_snapshot()
+
+    Args:
+        fp (string): filepath of the .npz file
+
+    Returns:
+        C (scipy.sparse.csr_matrix): cumulative adjacency
+        first (scipy.sparse.csr_matrix): first month codes of every pair
+        months (list): months accumulated in the snapshot
+    """
+    with np.load(fp) as data:
+        shape = tuple(data["shape"])
+        index = (data["row"], data["col"])
+        C = sparse.csr_matrix((data["weight"], index), shape=shape)
+        first = sparse.csr_matrix((data["first"].astype(np.int32), index),
+                                  shape=shape)
+        months = data["months"].tolist()
+
+    return C, first, months
+
+
+def adjacency_to_graph(C, cpds, cpd_date_dict, weighted=True, first=None,
+                       dates=None, repeat=False):
+    """ Builds an igraph network from a projected compound adjacency
+
+    Args:
+        C (scipy.sparse matrix): upper-triangular adjacency (from project_cpd_cpd())
+        cpds (list): compound ids, in the same order as the rows of C
+        cpd_date_dict (dict): links compound ids with their earliest date of entry (if None,
+            no "date" vertex attribute is added)
+        weighted (bool): add a "weight" edge attribute (number of shared patents)
+        first, dates: optional output of first_cooccurrence_dates() - adds a "date" edge
+            attribute with the first date each pair shared a patent
+        repeat (bool): repeat each edge by its weight, giving the unweighted multigraph
+            (one edge per shared patent) instead - weighted & first are ignored
+
+    Returns:
+        igraph network of compounds, one edge per co-occurring pair
+    """
+    C = sparse.coo_matrix(C)
+
+    G = ig.Graph()
+    G.add_vertices(len(cpds))
+    G.vs["name"] = cpds
+    if cpd_date_dict is not None:
+        G.vs["date"] = [cpd_date_dict[cpd] for cpd in cpds]
+
+    if repeat:
+        G.add_edges(np.repeat(np.column_stack((C.row, C.col)), C.data, axis=0))
+        return G
+
+    G.add_edges(np.column_stack((C.row, C.col)))
+    if weighted:
+        G.es["weight"] = C.data.tolist()
+    if first is not None:
+        codes = np.asarray(sparse.csr_matrix(first)[C.row, C.col]).ravel()
+        G.es["date"] = dates[codes - 1].tolist()
+
+    return G
+
+
+def benchmark_projection(n_cpds=20000, n_patents=2000, mean_cpds=30, seed=0):
+    """ Compares the sparse projection with build_network.build_cpd_network()
+
+    Builds synthetic patents whose compound counts follow a geometric distribution with the
+    given mean (heavy right tail, like SureChemBL patents) and whose compounds are drawn
+    with Zipf-like popularity (so common compounds co-occur in many patents). Runs both
+    implementations, checks that they link the same compound pairs, and prints timings of
+    finding the pairs alone and of the full graph build. n_patents should stay below 10k,
+    as build_cpd_network() skips one patent every 10k patents.
+
+    Args:
+        n_cpds (int): number of compounds
+        n_patents (int): number of patents
+        mean_cpds (int): mean number of compounds per patent
+        seed (int): random seed
+
+    Returns:
+        dict: runtime (seconds) of each implementation & stage
+    """
+    import build_network
+
+    rng = np.random.default_rng(seed)
+    cpds = ["SCHEMBL" + str(i) for i in range(n_cpds)]
+    cpd_date_dict = dict.fromkeys(cpds, "2015-01-01")
+    popularity = 1 / np.arange(1, n_cpds + 1)
+    popularity /= popularity.sum()
+    patent_cpd_links = {
+        "US-" + str(i): [cpds[j] for j in rng.choice(n_cpds, size, p=popularity)]
+        for i, size in enumerate(rng.geometric(1 / mean_cpds, n_patents))
+    }
+
+    times = {}
+    #Pairs only - combinations of every patent's compounds vs B^T B
+    G = ig.Graph(n_cpds)
+    G.vs["name"] = cpds
+    start = time.time()
+    n_pairs = sum(
+        len(build_network.find_cpd_cpd_edges(G, s))
+        for s in patent_cpd_links.values())
+    times["combinations pairs"] = time.time() - start
+
+    start = time.time()
+    C = project_cpd_cpd(build_incidence_matrix(cpds, patent_cpd_links))
+    times["sparse pairs"] = time.time() - start
+
+    #Full igraph networks
+    start = time.time()
+    G_combinations = build_network.build_cpd_network(cpds, cpd_date_dict,
+                                                     patent_cpd_links)
+    times["combinations graph"] = time.time() - start
+
+    start = time.time()
+    C = project_cpd_cpd(build_incidence_matrix(cpds, patent_cpd_links))
+    G_sparse = adjacency_to_graph(C, cpds, cpd_date_dict)
+    times["sparse graph"] = time.time() - start
+
+    assert set(map(tuple, map(sorted, G_combinations.get_edgelist()))) == \
+        set(G_sparse.get_edgelist())
+    assert sum(G_sparse.es["weight"]) == G_combinations.ecount() == n_pairs
+
+    print("Multigraph edges:", G_combinations.ecount(), "Unique pairs:",
+          G_sparse.ecount())
+    for stage in ["pairs", "graph"]:
+        print("{} - combinations: {:.2f}s, sparse: {:.2f}s ({:.0f}x)".format(
+            stage, times["combinations " + stage], times["sparse " + stage],
+            times["combinations " + stage] / times["sparse " + stage]))
+
+    return times
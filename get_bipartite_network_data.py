@@ -1,11 +1,16 @@
 import igraph as ig
 import numpy as np
 import pickle
+import os
 from tqdm import tqdm
 import pandas as pd
 from itertools import islice
 import time
 import subprocess
+import temporal_bipartite
+import component_tracker
+import cpd_patent_store
+import id_interning
 
 
 def build_month_list(start, end):
@@ -29,59 +34,164 @@ def build_month_list(start, end):
     return updates
 
 
-def build_master_cpd_date(updates):
+def build_master_cpd_date(updates, store_fp=None):
     """ Link compunds with the month it was first found
 
+    The first month of every compound is a min-month reduction over all monthly compound
+    lists: rows of all months are sorted by month (stable), and the first row of each
+    compound is kept. Saves the result as master_cpd_date_df.parquet (and the legacy
+    master_cpd_date_dict.p & master_cpd_date_df.p pickles).
+
     Args:
         updates (list): list of all months in a certain range
+        store_fp (string): root of the cpd_patent_store - if given, compounds are read from its
+            cpd_dates table instead of the per-month pickles
     """
     fp = "../../../mnt/Archive/Shared/PatentData/SureChemBL/"
 
-    master_cpd_date_dict = {}
-
     #Find all compounds belonging to a specific month
-    for update in tqdm(updates):
-        cpd_date_dict = pickle.load(
-            file=open(fp + "CpdPatentIdsDates/Cpd_Date_Dict/cpd_date_dict_" + update +
-                      ".p", "rb"))
+    if store_fp is not None:
+        df = cpd_patent_store.read_table("cpd_dates", store_fp,
+                                         columns=["cpdID", "month"],
+                                         start=updates[0], stop=updates[-1])
+        df.columns = ["Cpd", "Month"]
+        df = df[df["Month"].isin(updates)]
+    else:
+        frames = []
+        for update in tqdm(updates):
+            cpd_date_dict = pickle.load(
+                file=open(fp + "CpdPatentIdsDates/Cpd_Date_Dict/cpd_date_dict_" + update +
+                          ".p", "rb"))
+            frames.append(pd.DataFrame({"Cpd": list(cpd_date_dict.keys()),
+                                        "Month": update}))
+        df = pd.concat(frames, ignore_index=True)
+
+    #Keep the earliest month of each compound
+    df = df.sort_values(by="Month", kind="stable").drop_duplicates(
+        subset="Cpd").reset_index(drop=True)
 
-        for cpd in cpd_date_dict.keys():
-            #If that compound was not present before, add it to the master dictionary
-            if cpd not in master_cpd_date_dict:
-                master_cpd_date_dict[cpd] = update
+    save_master_cpd_date(df, fp)
+
+
+def save_master_cpd_date(df, fp):
+    """ Saves the master compound-month dataframe (and the legacy dictionary & dataframe pickles)
+
+    Args:
+        df (pandas dataframe): Cpd & Month (first month) of every compound
+        fp (string): filepath to SureChemBL data
 
-    pickle.dump(master_cpd_date_dict,
+    Returns:
+        None, writes master_cpd_date_df.parquet, master_cpd_date_dict.p & master_cpd_date_df.p
+        to /Cpd_Data
+    """
+    df.to_parquet(fp + "Cpd_Data/master_cpd_date_df.tmp.parquet", index=False)
+    os.replace(fp + "Cpd_Data/master_cpd_date_df.tmp.parquet",
+               fp + "Cpd_Data/master_cpd_date_df.parquet")
+
+    pickle.dump(dict(zip(df["Cpd"], df["Month"])),
                 file=open(fp + "Cpd_Data/master_cpd_date_dict.p", "wb"))
 
     #Save this dictionary as a dataframe for later analysis
-    df = pd.DataFrame(master_cpd_date_dict.items(), columns=["Cpd", "Month"])
     pickle.dump(df, file=open(fp + "Cpd_Data/master_cpd_date_df.p", "wb"))
 
 
-def link_ids_cpds(fp):
+def read_master_cpd_date(fp):
+    """ Reads the master compound-month dataframe (see build_master_cpd_date())
+
+    Args:
+        fp (string): filepath to SureChemBL data
+
+    Returns:
+        pandas dataframe with columns Cpd & Month (empty if it has not been built)
+    """
+    if os.path.isfile(fp + "Cpd_Data/master_cpd_date_df.parquet"):
+        return pd.read_parquet(fp + "Cpd_Data/master_cpd_date_df.parquet")
+    if os.path.isfile(fp + "Cpd_Data/master_cpd_date_df.p"):
+        return pickle.load(file=open(fp + "Cpd_Data/master_cpd_date_df.p", "rb"))
+
+    return pd.DataFrame({"Cpd": [], "Month": []}, dtype=str)
+
+
+def merge_master_cpd_date(cpds, months, fp):
+    """ Merges compounds & months into the master compound-month dataframe, keeping the
+    earliest month of each compound (used by build_network.apply_update())
+
+    Args:
+        cpds (array-like): compound ids
+        months (array-like): month each compound was seen (YYYY-MM)
+        fp (string): filepath to SureChemBL data
+
+    Returns:
+        int: number of compounds which were not in the master dataframe before
+    """
+    master = read_master_cpd_date(fp)
+    n_before = len(master)
+
+    df = pd.concat([
+        master,
+        pd.DataFrame({"Cpd": np.asarray(cpds, dtype=str),
+                      "Month": np.asarray(months, dtype=str)})
+    ], ignore_index=True)
+    df = df.sort_values(by="Month", kind="stable").drop_duplicates(
+        subset="Cpd").reset_index(drop=True)
+
+    save_master_cpd_date(df, fp)
+
+    return len(df) - n_before
+
+
+def link_ids_cpds(fp, cpd_table_fp=None):
     """ Links all compound SureChemBL Ids to index numbers in igraph network
 
+    Indicies are looked up in bulk, from the compound id table (Cpd_Data/cpd_ID_table/ by
+    default) if it exists, otherwise by mapping the cpd_ID_index_dict.p dictionary. Compounds
+    without an index get -1.
+
     Args:
         fp (string): filepath to Google Drive information
+        cpd_table_fp (string): directory of the compound id table (defaults to
+            Cpd_Data/cpd_ID_table/ in fp)
 
     Returns:
         None, writes a master dataframe containing SureChemBL cpd ids, dates, and indicies to
-        /Cpd_Data in GDrive
+        /Cpd_Data in GDrive (master_cpd_date_index_df.parquet & .p)
     """
-    cpd_date_df = pickle.load(file=open(fp + "Cpd_Data/master_cpd_date_df.p", "rb"))
-    cpd_ID_index_dict = pickle.load(file=open(fp + "Cpd_Data/cpd_ID_index_dict.p", "rb"))
+    cpd_date_df = read_master_cpd_date(fp)
+
+    if cpd_table_fp is None:
+        cpd_table_fp = fp + "Cpd_Data/cpd_ID_table/"
 
-    indicies = []
-    for index, row in tqdm(cpd_date_df.iterrows(), total=cpd_date_df.shape[0]):
-        try:
-            indicies.append(cpd_ID_index_dict[row["Cpd"]])
-        except:
-            indicies.append(-1)
+    if os.path.isdir(cpd_table_fp):
+        cpd_table = id_interning.load_id_table(cpd_table_fp)
+        cpd_date_df["Index"] = id_interning.encode(cpd_table,
+                                                   cpd_date_df["Cpd"].to_numpy(dtype=str))
+    else:
+        cpd_ID_index_dict = pickle.load(
+            file=open(fp + "Cpd_Data/cpd_ID_index_dict.p", "rb"))
+        cpd_date_df["Index"] = cpd_date_df["Cpd"].map(cpd_ID_index_dict).fillna(
+            -1).astype(np.int64)
 
-    cpd_date_df["Index"] = indicies
+    cpd_date_df.to_parquet(fp + "Cpd_Data/master_cpd_date_index_df.parquet", index=False)
     pickle.dump(cpd_date_df, file=open(fp + "Cpd_Data/master_cpd_date_index_df.p", "wb"))
 
 
+def build_master_cpd_data(updates, fp, store_fp=None):
+    """ Builds all master compound data: first months, igraph indicies & the month index
+
+    Args:
+        updates (list): list of all months (YYYY-MM)
+        fp (string): filepath to SureChemBL data
+        store_fp (string): root of the cpd_patent_store (see build_master_cpd_date())
+
+    Returns:
+        None, writes master_cpd_date_df, master_cpd_date_index_df & cpd_month_index/ to
+        /Cpd_Data
+    """
+    build_master_cpd_date(updates, store_fp)
+    link_ids_cpds(fp)
+    build_cpd_month_index(fp)
+
+
 def check_indicies(df):
     """ Checks how many dataframe entries have no index in bipartite network
 
@@ -94,10 +204,91 @@ def check_indicies(df):
     print("Number of cpds with no index:", len(df[df["Index"] == -1]))
 
 
+def build_cpd_month_index(fp):
+    """ Builds a month index over master_cpd_date_index_df
+
+    Sorts compounds by the month they were first seen, so all compounds seen up to a month
+    are a prefix of the sorted arrays. Saved to Cpd_Data/cpd_month_index/ as .npy files:
+        months.npy: sorted distinct months
+        offsets.npy: compounds first seen in months[:k + 1] are the first offsets[k + 1] entries
+        indicies.npy: igraph indicies of compounds (-1 if not in the network), sorted by month
+        ids.npy: SureChemBL ids of compounds, in the same order
+
+    Args:
+        fp (string): filepath to SureChemBL data
+
+    Returns:
+        None, writes the index to Cpd_Data/cpd_month_index/
+    """
+    df = pickle.load(file=open(fp + "Cpd_Data/master_cpd_date_index_df.p", "rb"))
+    df = df.sort_values(by="Month", kind="stable")
+
+    months, counts = np.unique(df["Month"].to_numpy(dtype=str), return_counts=True)
+    offsets = np.zeros(len(months) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    index_fp = fp + "Cpd_Data/cpd_month_index/"
+    os.makedirs(index_fp, exist_ok=True)
+    np.save(index_fp + "months.npy", months)
+    np.save(index_fp + "offsets.npy", offsets)
+    np.save(index_fp + "indicies.npy", df["Index"].to_numpy(dtype=np.int64))
+    np.save(index_fp + "ids.npy", df["Cpd"].to_numpy(dtype=str).astype("S"))
+
+    #Loaded copies of the old index are stale
+    _cpd_month_indicies.pop(fp, None)
+
+
+#Month indicies loaded in this process, by filepath (see load_cpd_month_index())
+_cpd_month_indicies = {}
+
+
+def load_cpd_month_index(
+        fp="../../../mnt/Archive/Shared/PatentData/SureChemBL/"):
+    """ Loads the compound month index (see build_cpd_month_index())
+
+    The index is loaded (memory-mapped) once per process and shared by all callers.
+
+    Args:
+        fp (string): filepath to SureChemBL data
+
+    Returns:
+        dict: "months", "offsets", "indicies" and "ids" arrays
+    """
+    if fp not in _cpd_month_indicies:
+        index_fp = fp + "Cpd_Data/cpd_month_index/"
+        _cpd_month_indicies[fp] = {
+            "months": np.load(index_fp + "months.npy"),
+            "offsets": np.load(index_fp + "offsets.npy"),
+            "indicies": np.load(index_fp + "indicies.npy", mmap_mode="r"),
+            "ids": np.load(index_fp + "ids.npy", mmap_mode="r"),
+        }
+
+    return _cpd_month_indicies[fp]
+
+
+def cpds_up_to(month, fp="../../../mnt/Archive/Shared/PatentData/SureChemBL/"):
+    """ Finds all compounds first seen up to (and including) a month
+
+    Args:
+        month (string): Month, in the form YYYY-MM
+        fp (string): filepath to SureChemBL data
+
+    Returns:
+        indicies (numpy array): igraph indicies of the compounds (-1 if not in the network)
+        ids (numpy array): SureChemBL ids of the compounds (as bytes)
+    """
+    index = load_cpd_month_index(fp)
+    end = index["offsets"][np.searchsorted(index["months"], month, side="right")]
+
+    return index["indicies"][:end], index["ids"][:end]
+
+
 def get_earlier_cpds(month):
     """ Finds all compounds which were inputted into SureChemBL prior to or equal
     to a given month
 
+    Uses the compound month index (see build_cpd_month_index()) if it has been built.
+
     Args:
         month (string): Month, in the form YYYY-MM
 
@@ -105,6 +296,19 @@ def get_earlier_cpds(month):
         pandas dataframe: dataframe containing SureChemBL patent id, month of
         first entry, and igraph index
     """
+    fp = "../../../mnt/Archive/Shared/PatentData/SureChemBL/"
+    if os.path.isdir(fp + "Cpd_Data/cpd_month_index/"):
+        index = load_cpd_month_index(fp)
+        indicies, ids = cpds_up_to(month, fp)
+
+        #Month column of the prefix only (months[:k + 1])
+        k = np.searchsorted(index["months"], month, side="right")
+        return pd.DataFrame({
+            "Cpd": np.asarray(ids).astype(str),
+            "Month": np.repeat(index["months"][:k], np.diff(index["offsets"][:k + 1])),
+            "Index": np.asarray(indicies)
+        })
+
     #Read in master compound-date-index dataframe
     master_fp = "../../../mnt/Archive/Shared/PatentData/SureChemBL/Cpd_Data/master_cpd_date_index_df.p"
     #drive_fp = "G:/Shared drives/SureChemBL_Patents/Cpd_Data/master_cpd_date_index_df.p"
@@ -124,6 +328,11 @@ def build_subgraph(G, month):
     """ Builds a cpd-patent bipartite subgraph containing only compounds present
     before or in a given month
 
+    If G carries month keys (build_network.build_full_bipartite_network(meta=...)), the
+    subgraph is exact: the edges up to the month (a prefix of G's edges) and the compounds
+    & patents they connect. Otherwise it holds compounds first seen up to the month and
+    all patents.
+
     Args:
         G (igraph network): full cpd-patent igraph network
         month (string): month
@@ -131,19 +340,36 @@ def build_subgraph(G, month):
     Returns:
         None, saves each subgraph to /scratch
     """
-    #Find all compounds before the given month
-    df = get_earlier_cpds(month)
+    if "edge_offsets" in G.attributes():
+        code = int(np.searchsorted(G["months"], month, side="right")) - 1
+        G_sub = G.subgraph_edges(range(G["edge_offsets"][code + 1]),
+                                 delete_vertices=True)
+
+        pickle.dump(
+            G_sub,
+            file=open("../../../mnt/Archive/Shared/PatentData/SureChemBL/Graphs/cpd_patent_" + month + ".p",
+                      "wb"))
+
+        return G_sub
 
     #Build subgraph from full igraph subgraph (G.subgraph, include only relevant
     # cpd indicies and ALL PATENTS (to avoid cpd-cpd edges))
     num_cpds = 22820274  #Numbers from build_network.py output
     num_patents = 5136193
 
+    #Find all compounds before the given month
+    fp = "../../../mnt/Archive/Shared/PatentData/SureChemBL/"
+    if os.path.isdir(fp + "Cpd_Data/cpd_month_index/"):
+        cpd_indicies = np.asarray(cpds_up_to(month, fp)[0])
+    else:
+        cpd_indicies = get_earlier_cpds(month)["Index"].to_numpy()
+
     #Index list of all compounds present in earlier dates, including all patents
-    indicies = df["Index"].tolist() + list(
-        np.arange(num_cpds, num_cpds + num_patents, 1))
     #Remove all -1s, not entirely sure what's going on with these
-    indicies = [x for x in indicies if x != -1]
+    indicies = np.concatenate([
+        cpd_indicies[cpd_indicies != -1],
+        np.arange(num_cpds, num_cpds + num_patents, 1)
+    ])
 
     G_sub = G.subgraph(indicies)
     # print(ig.summary(G_sub))
@@ -156,6 +382,31 @@ def build_subgraph(G, month):
     return G_sub
 
 
+def build_temporal_network(fp, months):
+    """ Builds the temporal cpd-patent network (see temporal_bipartite.py) from the bipartite edgelist
+
+    Args:
+        fp (string): filepath to SureChemBL data
+        months (list): sorted months of the network
+
+    Returns:
+        dict: temporal network, also saved to Graphs/cpd_patent_temporal/
+    """
+    import build_network
+
+    patents, cpds, meta = build_network.load_bipartite_edges(
+        fp + "CpdPatentIdsDates/index_edgelist_bipartite")
+    edge_months, months = temporal_bipartite.edge_month_codes(meta, months)
+
+    T = temporal_bipartite.build_temporal_bipartite(
+        patents, cpds, edge_months, months,
+        len(id_interning.load_id_table(fp + "Cpd_Data/cpd_ID_table/")["ids"]),
+        len(id_interning.load_id_table(fp + "CpdPatentIdsDates/patent_ID_table/")["ids"]))
+    temporal_bipartite.save_temporal_bipartite(T, fp + "Graphs/cpd_patent_temporal/")
+
+    return T
+
+
 def read_graph(update):
     """ Reads a cpd-patent graph in .p format
 
@@ -176,25 +427,60 @@ def read_graph(update):
     return G
 
 
+def get_partition_degrees(G):
+    """ Finds the degrees of all vertices, compounds & patents of a igraph network in one pass
+
+    Degrees and vertex types are read from the network once, and each partition is selected
+    with a mask over the type array, rather than by iterating over vertices. G may also be a
+    month view of the temporal network (temporal_bipartite.month_view()), whose degrees are
+    counted from its edge arrays.
+
+    Args:
+        G (igraph object): igraph network - or a temporal network view
+
+    Returns:
+        degrees (numpy array): degrees of all vertices (in order of igraph vertex index)
+        cpd_degrees (numpy array): degrees of compounds (type 0)
+        patent_degrees (numpy array): degrees of patents (type 1)
+    """
+    if isinstance(G, dict):
+        #Temporal view - only vertices present by the view's month
+        cpd_degrees, patent_degrees = temporal_bipartite.view_degrees(G)
+        cpd_mask, patent_mask = temporal_bipartite.view_vertices(G)
+        cpd_degrees, patent_degrees = cpd_degrees[cpd_mask], patent_degrees[patent_mask]
+        degrees = np.concatenate([cpd_degrees, patent_degrees])
+    else:
+        degrees = np.array(G.degree())
+        types = np.array(G.vs["type"])
+        #cpd type = 0, patent type = 1
+        cpd_degrees, patent_degrees = degrees[types == 0], degrees[types == 1]
+
+    return degrees, cpd_degrees, patent_degrees
+
+
 def get_degrees(G, type):
     """ Finds the degree distribution of a igraph network
 
+    Use get_partition_degrees() to get more than one distribution of the same network -
+    each call reads the degrees of the whole network.
+
     Args:
         G (igraph object): igraph network, contains a variety of data including degrees between nodes
+            - or a temporal network view
         type (sting): type of degree distribution to return: "all", "cpd", or "patent".
             No other options are allowed and will result in returning -1
 
     Returns:
-        G.degree (list): list of degrees (in order of igraph vertex index)
+        G.degree (numpy array): array of degrees (in order of igraph vertex index)
     """
+    degrees, cpd_degrees, patent_degrees = get_partition_degrees(G)
+
     if type == "all":
-        return G.degree()
+        return degrees
     elif type == "cpd":
-        #cpd type = 0
-        return G.degree([n for n in G.vs if n["type"] == 0])
+        return cpd_degrees
     elif type == "patent":
-        #patent type = 1
-        return G.degree([n for n in G.vs if n["type"] == 1])
+        return patent_degrees
     else:
         print("Incorrect degree option")
         return -1
@@ -214,6 +500,31 @@ def get_id_degree(G):
     return id_degree_dict
 
 
+def get_lcc_ids(month, fp="../../../mnt/Archive/Shared/PatentData/SureChemBL/"):
+    """ Finds the SureChemBL ids of compounds & patents in the largest connected component
+
+    Reads the LCC bitmask of the month saved by component_tracker.track_temporal_bipartite()
+    (see main()).
+
+    Args:
+        month (string): month, in the form YYYY-MM
+        fp (string): filepath to SureChemBL data
+
+    Returns:
+        cpd_ids, patent_ids (numpy arrays): SureChemBL ids in the LCC
+    """
+    T = temporal_bipartite.load_temporal_bipartite(fp + "Graphs/cpd_patent_temporal/")
+    members = component_tracker.load_lcc_membership(fp + "NetworkStats/LCC/", month,
+                                                    T["n_cpds"] + T["n_patents"])
+
+    cpd_table = id_interning.load_id_table(fp + "Cpd_Data/cpd_ID_table/")
+    patent_table = id_interning.load_id_table(fp + "CpdPatentIdsDates/patent_ID_table/")
+
+    return (id_interning.decode(cpd_table, members[members < T["n_cpds"]]),
+            id_interning.decode(patent_table,
+                                members[members >= T["n_cpds"]] - T["n_cpds"]))
+
+
 def get_network_stats(G, month):
     """Finds basic network statistics SureChemBL cpd-patent graphs in a given range
 
@@ -243,11 +554,8 @@ def get_network_stats(G, month):
 
     # start = time.time()
 
-    #Full Degrees
-    degrees = get_degrees(G, "all")
-    #Cpd & Patent degrees
-    cpd_degrees = get_degrees(G, "cpd")
-    patent_degrees = get_degrees(G, "patent")
+    #Full, Cpd & Patent degrees (read from G once)
+    degrees, cpd_degrees, patent_degrees = get_partition_degrees(G)
 
     network_stats["Nodes"] = G.vcount()
     network_stats["Edges"] = G.ecount()
@@ -261,7 +569,7 @@ def get_network_stats(G, month):
     # print("Time elapsed for degree stats:", time.time() - start)
 
     network_stats["LCC Size"] = G.clusters().giant().vcount()
-    #TODO: LCC SureChemBL ids
+    #LCC SureChemBL ids - see get_lcc_ids() (saved for every month by component_tracker)
     # lcc_ids = [G.vs.select(c)["name"] for c in G.clusters()]
 
     #network_stats["Clustering coefficient"] = G.transitivity_undirected()
@@ -310,11 +618,20 @@ def main():
 
     #1a: Link date of first entry & index of compounds
     # print("--- Building master compound-index dictionary ---")
-    # build_master_cpd_date(updates) #NOTE: should only be run once
-    # link_ids_cpds("../../../mnt/Archive/Shared/PatentData/SureChemBL/") #NOTE: should only be run once
+    # build_master_cpd_data(updates, "../../../mnt/Archive/Shared/PatentData/SureChemBL/") #NOTE: should only be run once
     # print("--- Completed master compound-index dictionary ---")
 
 
+    #1b: Network stats of every month from the temporal network (no subgraphs)
+    # fp = "../../../mnt/Archive/Shared/PatentData/SureChemBL/"
+    # build_temporal_network(fp, updates) #NOTE: should only be run once
+    # T = temporal_bipartite.load_temporal_bipartite(fp + "Graphs/cpd_patent_temporal/")
+    # df = temporal_bipartite.temporal_network_stats(T, updates)
+    # df.to_csv(fp + "NetworkStats/networkStats_temporal.csv")
+    # #Components of every month, saving LCC membership (see get_lcc_ids())
+    # df, histograms = component_tracker.track_temporal_bipartite(T, fp + "NetworkStats/LCC/")
+    # df.to_csv(fp + "NetworkStats/componentStats_temporal.csv")
+
     #Updates for network statistics
     updates = build_month_list(2020, 2022)
 
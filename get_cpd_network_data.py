@@ -10,22 +10,31 @@ import igraph as ig
 import numpy as np
 import pickle
 from itertools import islice
-from itertools import zip_longest
 from itertools import accumulate
 import os
 import subprocess
 import pandas as pd
+from scipy import sparse
+from scipy import stats
+import graph_store
+import id_interning
 
 
 def get_degrees(G):
     """ Finds the degree distribution of a igraph network
 
+    For weighted cpd-cpd graphs (built with build_cpd_network(weighted=True)), the degree is
+    the sum of edge weights, which equals the degree in the unweighted multigraph.
+
     Args:
         G (igraph object): igraph network, contains a variety of data including degrees between nodes
 
     Returns:
         G.degree (list): list of degrees (in order of igraph vertex index)
     """
+    if "weight" in G.es.attributes():
+        return [int(d) for d in G.strength(weights="weight")]
+
     return G.degree()
 
 
@@ -38,17 +47,17 @@ def get_id_degree(G):
     Returns:
         id_degree_dict (dictionary): Associates SurechemBL compound ids with degree value
     """
-    id_degree_dict = dict(zip(G.vs["name"], G.degree()))
+    id_degree_dict = dict(zip(G.vs["name"], get_degrees(G)))
 
     return id_degree_dict
 
 
 def read_cpdcpd_graph(update):
-    """ Reads a cpd-cpd graph in .gmlz format
+    """ Reads a cpd-cpd graph in binary graph (see graph_store.py) or .gmlz format
 
-    Takes a stored igraph network in .gmlz format and reads it into igraph form.
-    Assumes that the data are stored in the /Volumes/Macintosh HD 4/SureChemBL/Graphs/G_Cpd directory and in the format
-    G_cpd_<update>.gmlz.
+    Takes a stored igraph network and reads it into igraph form. Assumes that the data are
+    stored in the /Volumes/Macintosh HD 4/SureChemBL/Graphs/G_Cpd directory and in the format
+    G_cpd_<update>.graph (binary, fast to load) or G_cpd_<update>.gmlz.
 
     Args:
         fp (string): filepath to a specific cpd-cpd graph
@@ -56,11 +65,18 @@ def read_cpdcpd_graph(update):
     Returns:
         G (igraph object): cpd-cpd network pertaining to a specific update
     """
-    fp = "../../mnt/Archive/Shared/PatentData/SureChemBL/Graphs/G_Cpd/G_cpd_" + update + ".gmlz"
-    G = ig.Graph.Read_GraphMLz(fp)
+    fp = "../../mnt/Archive/Shared/PatentData/SureChemBL/Graphs/G_Cpd/G_cpd_" + update
+    if os.path.isdir(fp + ".graph"):
+        G = graph_store.read_graph(fp + ".graph")
+    else:
+        G = ig.Graph.Read_GraphMLz(fp + ".gmlz")
     print("Loaded graph:", update)
     print(ig.summary(G))
 
+    # #One time function - to save all gmlz files as binary graphs to save time
+    # graph_store.write_graph(G, fp + ".graph")
+    # print("Converted G")
+
     # #One time function - to save all gmlz files as pickles to save time
     # pickle.dump(G, file=open("Data/Graphs/G_cpd_" + update + ".p", "wb"))
     # print("Dumped G")
@@ -71,7 +87,65 @@ def read_cpdcpd_graph(update):
     return G
 
 
-def get_network_stats(start, stop):
+def approximate_transitivity(G, n_samples=100000, confidence=0.95, seed=0):
+    """ Estimates the global clustering coefficient (transitivity) by wedge sampling
+
+    Transitivity is the fraction of wedges (paths u-v-w) which are closed by an edge u-w.
+    Wedges are sampled uniformly: a center v is drawn with probability proportional to its
+    number of wedges, d(v)(d(v)-1)/2, and two distinct neighbors of v are drawn uniformly.
+    The estimate is the fraction of sampled wedges which are closed, with a normal
+    approximation confidence interval - its width depends only on n_samples, not on the
+    size of the graph. Multiple edges are counted once (as in G.simplify()).
+
+    Args:
+        G (igraph object): undirected igraph network
+        n_samples (int): number of wedges to sample
+        confidence (float): confidence level of the interval
+        seed (int): random seed
+
+    Returns:
+        estimate, low, high (floats): estimated transitivity & confidence interval
+    """
+    if not G.is_simple():
+        G = G.copy().simplify()
+
+    degrees = np.array(G.degree(), dtype=np.int64)
+    wedges = degrees * (degrees - 1) / 2
+    if wedges.sum() == 0:
+        return np.nan, np.nan, np.nan
+
+    rng = np.random.default_rng(seed)
+    centers = np.sort(
+        np.searchsorted(np.cumsum(wedges), rng.random(n_samples) * wedges.sum(),
+                        side="right"))
+
+    #Two distinct neighbor positions for each sampled center
+    d = degrees[centers]
+    i = (rng.random(n_samples) * d).astype(np.int64)
+    j = (rng.random(n_samples) * (d - 1)).astype(np.int64)
+    j += j >= i
+
+    #Neighbors are only looked up once for each distinct center
+    u = np.empty(n_samples, dtype=np.int64)
+    w = np.empty(n_samples, dtype=np.int64)
+    unique_centers, starts = np.unique(centers, return_index=True)
+    for center, start, stop in zip(unique_centers, starts,
+                                   np.append(starts[1:], n_samples)):
+        neighbors = np.array(G.neighbors(center))
+        u[start:stop] = neighbors[i[start:stop]]
+        w[start:stop] = neighbors[j[start:stop]]
+
+    #Closed if u-w is an edge
+    closed = np.array(G.get_eids(np.column_stack((u, w)).tolist(), error=False)) != -1
+
+    estimate = closed.mean()
+    z = stats.norm.ppf(0.5 + confidence / 2)
+    error = z * np.sqrt(estimate * (1 - estimate) / n_samples)
+
+    return estimate, max(estimate - error, 0), min(estimate + error, 1)
+
+
+def get_network_stats(start, stop, clustering="exact", n_samples=100000):
     """Finds basic network statistics SureChemBL cpd-cpd graphs in a given range
 
     Calculates num nodes, num edges, avg degree, max degree,
@@ -80,6 +154,10 @@ def get_network_stats(start, stop):
     Args:
         start (int): year of starting point for analysis
         end (int): year of ending point (inclusive)
+        clustering (string): "exact" (G.transitivity_undirected()), "approximate" (wedge
+            sampling, see approximate_transitivity() - adds a 95% confidence interval), or
+            None to skip the clustering coefficient
+        n_samples (int): number of wedges sampled for the approximate clustering coefficient
 
     Returns:
         (none): writes a file containing the basic network statistics for each month
@@ -103,11 +181,19 @@ def get_network_stats(start, stop):
         id_degrees = get_id_degree(G)
         # del (G)
         network_stats["Nodes"] = G.vcount()
-        network_stats["Edges"] = G.ecount()
+        #Weighted graphs hold one edge per cpd pair - edges of the multigraph are the weight sum
+        network_stats["Edges"] = sum(G.es["weight"]) if "weight" in G.es.attributes() \
+            else G.ecount()
         network_stats["Avg Degree"] = np.mean(degrees)
         network_stats["Max Degree"] = max(degrees)
         network_stats["LCC Size"] = G.clusters().giant().vcount()
-        network_stats["Clustering coefficient"] = G.transitivity_undirected()
+        if clustering == "exact":
+            network_stats["Clustering coefficient"] = G.transitivity_undirected()
+        elif clustering == "approximate":
+            estimate, low, high = approximate_transitivity(G, n_samples)
+            network_stats["Clustering coefficient"] = estimate
+            network_stats["Clustering CI low"] = low
+            network_stats["Clustering CI high"] = high
         print(network_stats)
         print()
         data.append(network_stats)
@@ -157,32 +243,109 @@ def build_month_list(start, end):
     return updates
 
 
+def _pad(array, length):
+    """ Pads a 1-D array with zeros up to length """
+    if len(array) >= length:
+        return array
+
+    return np.concatenate([array, np.zeros(length - len(array), dtype=array.dtype)])
+
+
+def accumulate_degree_distribution(totals, degrees):
+    """ Adds one degree distribution to running totals, without keeping the degrees
+
+    Keeps fixed-size arrays: summed degree counts & probabilities (length max degree + 1),
+    and difference arrays from which the average degree at each rank (the i-th largest
+    degree, averaged over all distributions with at least i + 1 vertices) is recovered. The
+    degree at rank i is the number of d >= 1 with more than i vertices of degree >= d, so
+    each distribution only adds its degree counts at N(>= d) for every degree d.
+
+    Args:
+        totals (dict): running totals (empty dictionary to start)
+        degrees (array-like): degrees of one network
+
+    Returns:
+        numpy array: (values, counts) of the network's degrees
+    """
+    values, counts = np.unique(np.asarray(degrees, dtype=np.int64), return_counts=True)
+    histogram = np.zeros(values[-1] + 1 if len(values) else 1, dtype=np.int64)
+    histogram[values] = counts
+    n = counts.sum()
+
+    #Number of vertices with degree >= d, for d = 1 ... max degree
+    at_least = np.cumsum(histogram[::-1])[::-1][1:]
+
+    length = max(len(histogram), len(totals.get("counts", [])))
+    rank_length = max(n + 1, len(totals.get("rank_sums", [])))
+    totals["n"] = totals.get("n", 0) + 1
+    totals["counts"] = _pad(totals.get("counts", np.zeros(0, dtype=np.int64)),
+                            length)
+    totals["counts"][:len(histogram)] += histogram
+    totals["probabilities"] = _pad(totals.get("probabilities", np.zeros(0)), length)
+    totals["probabilities"][:len(histogram)] += histogram / max(n, 1)
+
+    totals["rank_sums"] = _pad(totals.get("rank_sums", np.zeros(0, dtype=np.int64)),
+                               rank_length)
+    totals["rank_sums"][0] += len(at_least)
+    np.add.at(totals["rank_sums"], at_least, -1)
+    totals["rank_counts"] = _pad(
+        totals.get("rank_counts", np.zeros(0, dtype=np.int64)), rank_length)
+    totals["rank_counts"][0] += 1
+    totals["rank_counts"][n] -= 1
+
+    return np.array([values, counts])
+
+
+def finalize_degree_distribution(totals):
+    """ Combines running totals (see accumulate_degree_distribution()) into distributions
+
+    Args:
+        totals (dict): running totals
+
+    Returns:
+        dict: "cumulative" (summed count of each degree), "average" (average fraction of
+        vertices with each degree) and "rank_average" (average i-th largest degree) arrays
+    """
+    rank_sums = np.cumsum(totals["rank_sums"])
+    rank_counts = np.cumsum(totals["rank_counts"])
+    n_ranks = np.count_nonzero(rank_counts)
+
+    return {
+        "cumulative": totals["counts"],
+        "average": totals["probabilities"] / totals["n"],
+        "rank_average": rank_sums[:n_ranks] / rank_counts[:n_ranks],
+    }
+
+
 def get_degree_distributions():
     """ Finds and saves degrees across SureChemBL update graphs
 
-    Collects degrees in one place (all_degrees, list of degree distributions)
-    and finds the average degree distribution (avg, single list). Saves both
-    to the 'Data/Degrees/' directory
+    Streams through the degree distributions, keeping only each one's histogram (distinct
+    degrees & counts) and running totals, so memory is proportional to the largest degree
+    rather than to vertices x months. Saves the histograms (degree_histograms.p, linking
+    each file with its (values, counts)), the cumulative & average degree distributions
+    (degree_distributions.npz), and the average degree distribution by rank (avg, the
+    column-wise average of all descending degree lists) to the 'Data/Degrees/' directory
 
     """
     #Load all degrees associated with quarterly updates
     print("\n----- Loading Degree Distributions -----\n")
-    all_degrees = []
-    for f in os.listdir("Data/Degrees/"):
+    totals = {}
+    histograms = {}
+    for f in sorted(os.listdir("Data/Degrees/")):
         if f.startswith("degrees_"):
             degrees = pickle.load(file=open("Data/Degrees/" + f, "rb"))
-            degrees.sort(reverse=True)
-            all_degrees.append(degrees)
-    pickle.dump(all_degrees, file=open("Data/Degrees/all_degrees.p", "wb"))
+            histograms[f] = accumulate_degree_distribution(totals, degrees)
+    pickle.dump(histograms, file=open("Data/Degrees/degree_histograms.p", "wb"))
 
-    #Calculate & plot average of all degrees (avg over each column)
-    #Note: takes ~20 minutes
+    #Calculate average of all degrees (avg over each rank)
     print("\n----- Calculating average degree distribution -----\n")
-    avg = [
-        np.ma.average(np.ma.masked_values(temp_list, None))
-        for temp_list in zip_longest(*all_degrees)
-    ]
-    pickle.dump(avg, file=open("Data/Degrees/avg_degree_list.p", "wb"))
+    distributions = finalize_degree_distribution(totals)
+    np.savez("Data/Degrees/degree_distributions.npz",
+             cumulative=distributions["cumulative"],
+             average=distributions["average"])
+    pickle.dump(distributions["rank_average"],
+                file=open("Data/Degrees/avg_degree_list.p", "wb"))
 
 
 def link_id_degrees(full_id_degrees, id_degrees, i, bins):
@@ -267,10 +430,142 @@ def pref_attachment_calculation(full_id_degrees):
     return pref_attach_dict
 
 
+def build_degree_matrix(id_degree_dicts, cpd_table):
+    """ Builds a sparse (compounds x updates) degree matrix from id:degree dictionaries
+
+    Rows are compound id table indicies (see id_interning.py) and column i holds the degrees of
+    update i, replacing the dictionary of id:[degrees] lists built by link_id_degrees().
+    Compounds which are not in the id table are kept, as extra rows after the table's
+    compounds (in the order they are first seen).
+
+    Args:
+        id_degree_dicts (iterable): id:degree dictionary of every update, in order
+        cpd_table (dict): compound id table (from id_interning.load_id_table())
+
+    Returns:
+        M (scipy.sparse.csr_matrix): (len(cpd_table["ids"]) + len(extra_ids)) x updates
+            degree matrix
+        present (numpy array): boolean mask of compounds found in any update
+        extra_ids (list): ids of the extra rows (compounds not in the id table)
+    """
+    n_cpds = len(cpd_table["ids"])
+    extra_rows = {}
+
+    rows, cols, values = [], [], []
+    for i, id_degrees in enumerate(id_degree_dicts):
+        ids = list(id_degrees.keys())
+        indicies = id_interning.encode(cpd_table, ids)
+        degrees = np.fromiter(id_degrees.values(), dtype=np.int64,
+                              count=len(id_degrees))
+
+        missing = np.flatnonzero(indicies == -1)
+        if len(missing):
+            print("Update", i, "- ids not in id table:", len(missing))
+            indicies[missing] = [
+                extra_rows.setdefault(ids[j], n_cpds + len(extra_rows))
+                for j in missing
+            ]
+
+        rows.append(indicies)
+        cols.append(np.full(len(indicies), i))
+        values.append(degrees)
+
+    n_rows, n_updates = n_cpds + len(extra_rows), len(rows)
+    rows = np.concatenate(rows)
+    present = np.zeros(n_rows, dtype=bool)
+    present[rows] = True
+
+    M = sparse.csr_matrix((np.concatenate(values), (rows, np.concatenate(cols))),
+                          shape=(n_rows, n_updates))
+
+    return M, present, list(extra_rows)
+
+
+def pref_attachment_arrays(M, chunksize=1000000):
+    """ Calculates cumulative degrees & preferential attachment indicies from a degree matrix
+
+    Vectorized replace_zeroes() & pref_attachment_calculation(): the cumulative degree is the
+    cumsum along each row, and the preferential attachment index is the mean of its
+    differences. Rows are processed in chunks, so only chunksize rows are dense at once.
+
+    Args:
+        M (scipy.sparse matrix): (compounds x updates) degree matrix
+        chunksize (int): number of rows made dense at once
+
+    Returns:
+        cumulative (numpy array): int32 (compounds x updates) cumulative degrees
+        pref_attach (numpy array): preferential attachment index of every compound (nan if
+            there is only one update)
+    """
+    M = sparse.csr_matrix(M)
+    cumulative = np.empty(M.shape, dtype=np.int32)
+    pref_attach = np.full(M.shape[0], np.nan)
+
+    for start in range(0, M.shape[0], chunksize):
+        stop = min(start + chunksize, M.shape[0])
+        cumulative[start:stop] = np.cumsum(M[start:stop].toarray(), axis=1)
+        if M.shape[1] > 1:
+            pref_attach[start:stop] = np.diff(cumulative[start:stop],
+                                              axis=1).mean(axis=1)
+
+    return cumulative, pref_attach
+
+
 def calculate_preferential_attachment(start, stop):
     """ Calculates preferential attachment index (see Rednar 2004) for SureChemBL degrees
     across all patents
 
+    Uses data stored in the 'Data/Degrees/id_degrees_*' files to build a preferential
+    attachment index. Degrees are held in a (compounds x updates) matrix indexed by the
+    compound id table, rather than a dictionary of lists. Saves both the cumulative degrees
+    (summed over time) and the preferential attachment indicies of each compound to the
+    'Data/Degrees' directory - as arrays (full_id_degrees_*.npz, holding "ids", "indicies",
+    "cumulative" & "pref_attach", read by cpd_analysis.load_full_id_degrees()) and as the
+    id:index pref_attach_dict pickle
+    """
+    print("\n----- Building id-degree matrix -----\n")
+    updates = build_month_list(start, stop)
+
+    cpd_table = id_interning.load_id_table(
+        "../../mnt/Archive/Shared/PatentData/SureChemBL/Cpd_Data/cpd_ID_table/")
+
+    #Load id_degree dictionaries - attempting through GDrive
+    M, present, extra_ids = build_degree_matrix(
+        (pickle.load(file=open(
+            "SureChemBL_Patents:Degrees/Months/id_degrees_" + update + ".p",
+            "rb")) for update in updates), cpd_table)
+
+    print("\n----- Calculating preferential attachment -----\n")
+    #Only compounds seen in some update are kept (as in the legacy dictionaries)
+    indicies = np.flatnonzero(present)
+    cumulative, pref_attach = pref_attachment_arrays(M[indicies])
+
+    #Indicies past the id table are compounds which are not in it
+    n_cpds = len(cpd_table["ids"])
+    ids = np.concatenate([
+        id_interning.decode(cpd_table, indicies[indicies < n_cpds]),
+        np.asarray(extra_ids, dtype=str)[indicies[indicies >= n_cpds] - n_cpds]
+    ])
+
+    np.savez("/scratch/jmalloy3/Degrees/full_id_degrees_" + str(start) + "_" +
+             str(stop) + ".npz",
+             ids=ids,
+             indicies=indicies,
+             cumulative=cumulative,
+             pref_attach=pref_attach)
+
+    pref_attach_dict = dict(zip(ids.tolist(), pref_attach))
+
+    pickle.dump(pref_attach_dict,
+                file=open(
+                    "/scratch/jmalloy3/pref_attach_dict_" + str(start) + "_" +
+                    str(stop) + ".p", "wb"))
+
+
+def calculate_preferential_attachment_dicts(start, stop):
+    """ Calculates preferential attachment index (see Rednar 2004) for SureChemBL degrees
+    across all patents, using dictionaries of id:[degrees] lists (legacy implementation)
+
     Uses data stored in the 'Data/Degrees/id_degrees_*' files to build a preferential
     attachment index. Saves both the full list of id:degree pairs (summed over time)
     and the preferential attachment indicies of each degree to pickle files in
@@ -338,7 +633,7 @@ def clear_scratch(start, stop):
     Move: id_degrees (in Degrees/Months) - worked
         : degrees (in Degrees/Months) - worked
         : network_stats (in NetworkStats)
-        : full_id_degrees (in Degrees)
+        : full_id_degrees (in Degrees, .npz arrays)
         : pref_attach_dict (in scratch/jmalloy3)
 
     Delete: G_cpd_XXXX-MM.p, in Graphs/
@@ -347,10 +642,9 @@ def clear_scratch(start, stop):
     fps_months = [
         "Degrees/Months/id_degrees_", "Degrees/Months/degrees_", "Graphs/C_cpd_"
     ]
-    fps_years = [
-        "NetworkStats/stats_", "Degrees/full_id_degrees_",
-        "pref_attach_dict_"
-    ]
+    #(filepath, extension) - full_id_degrees are saved as arrays, not pickled
+    fps_years = [("NetworkStats/stats_", ".p"),
+                 ("Degrees/full_id_degrees_", ".npz"), ("pref_attach_dict_", ".p")]
 
     updates = build_month_list(start, stop)
     for update in updates:
@@ -361,13 +655,13 @@ def clear_scratch(start, stop):
                 "SureChemBL_Patents:" + f + update + ".p"
             ])
 
-    for f in fps_years:
+    for f, ext in fps_years:
         #Move all files to GDrive
         subprocess.run([
             "rclone", "moveto",
-            "/scratch/jmalloy3/" + f + str(start) + "_" + str(stop) + ".p",
+            "/scratch/jmalloy3/" + f + str(start) + "_" + str(stop) + ext,
             "SureChemBL_Patents:" + f + str(start) + "_" + str(stop) +
-            ".p"
+            ext
         ])
 
 
@@ -4,6 +4,8 @@ import numpy as np
 import os
 import re
 import pandas as pd
+import build_network
+import cpd_patent_store
 
 
 def build_month_list(start, end):
@@ -27,17 +29,36 @@ def build_month_list(start, end):
     return updates
 
 
-def get_pickled_files(month):
+def get_pickled_files(month,
+                      store_fp="../../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentStore/"):
+    """ Reads a month's patent dates & patent-cpd relations
+
+    Months in the cpd_patent_store are read from it, other months from the per-month files
+    in CpdPatentIdsDates.
+
+    Args:
+        month (string): month, in the form YYYY-MM
+        store_fp (string): filepath to the root of the cpd_patent_store
+
+    Returns:
+        patent_date_dict (dict): links patents to their earliest date in the month
+        patent_cpd_edges (dict): links patents to their compounds
+        (both None if the month's files are missing or corrupted)
+    """
+    pickle_fp = "../../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/"
     try:
-        patent_date_dict = pickle.load(
-            open(
-                "../../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/Patent_Date_Dict/patent_date_dict_"
-                + month + ".p", "rb"))
-        patent_cpd_edges = pickle.load(
-            open(
-                "../../../../mnt/Archive/Shared/PatentData/SureChemBL/CpdPatentIdsDates/Patent_Cpd_Edges/patent_cpd_edges_"
-                + month + ".p", "rb"))
-    except EOFError:
+        patent_date_dict = cpd_patent_store.read_id_date_dict(
+            "patent_dates", month, store_fp, pickle_fp)
+
+        if cpd_patent_store.has_month("patent_cpd_edges", month, store_fp):
+            df = cpd_patent_store.read_month("patent_cpd_edges", month, store_fp)
+            patent_cpd_edges = df.groupby("patentID", sort=False)["cpdID"].agg(
+                list).to_dict()
+        else:
+            #Reads either the compact patent_cpd_index_*.npz or legacy patent_cpd_edges_*.p file
+            patent_cpd_edges = build_network.load_patent_cpd_edges(
+                pickle_fp + "Patent_Cpd_Edges/", "_" + month)
+    except (EOFError, FileNotFoundError):
         print(f"{month} has corrupted files")
         patent_date_dict = None
         patent_cpd_edges = None
@@ -0,0 +1,277 @@
+""" Binary storage of igraph networks
+
+Replaces the zipped GraphML files (G_cpd_<update>.gmlz) and pickles (G_cpd_<update>.p)
+of monthly graphs, which take minutes to parse, with a directory of numpy arrays:
+
+    <fp>/meta.json: number of vertices & edges, attribute columns & graph attributes
+    <fp>/edges.npy: (n_edges x 2) source & target vertex indicies
+    <fp>/v_<attribute>.npy: one file per vertex attribute
+    <fp>/e_<attribute>.npy: one file per edge attribute
+
+Numeric columns are stored as they are. String columns where values repeat (e.g.,
+dates) are dictionary-encoded as integer codes (<column>.npy) plus the distinct values
+(<column>.values.npy), and other string columns are stored as fixed-width byte strings
+(UTF-8 encoded). Graph attributes are stored in meta.json, with numpy values converted to
+plain numbers & lists.
+Uncompressed columns can be memory-mapped; any column can instead be gzip-compressed
+(<column>.npy.gz), which is read fully into memory.
+
+"""
+
+import os
+import json
+import gzip
+import time
+import pickle
+import numpy as np
+import igraph as ig
+
+
+def _save_column(fp, name, array, compress=False):
+    """ Saves one array to fp/name.npy (or fp/name.npy.gz if compressed) """
+    if compress:
+        with gzip.open(os.path.join(fp, name + ".npy.gz"), "wb",
+                       compresslevel=1) as f:
+            np.save(f, array)
+    else:
+        np.save(os.path.join(fp, name + ".npy"), array)
+
+
+def _load_column(fp, name, compress=False, mmap=True):
+    """ Loads an array saved by _save_column() """
+    if compress:
+        with gzip.open(os.path.join(fp, name + ".npy.gz"), "rb") as f:
+            return np.load(f)
+
+    return np.load(os.path.join(fp, name + ".npy"), mmap_mode="r" if mmap else None)
+
+
+def _encode_column(values):
+    """ Converts a list of attribute values into arrays
+
+    Args:
+        values (list): attribute values of every vertex/edge
+
+    Returns:
+        kind (string): "numeric", "category" or "string"
+        codes (numpy array): the column (integer codes for "category")
+        categories (numpy array): distinct values ("category" only, otherwise None)
+    """
+    array = np.asarray(values)
+    if array.dtype.kind in "biuf":
+        return "numeric", array, None
+
+    #Strings (missing values, e.g. from GraphML, are stored as "")
+    array = np.asarray(["" if v is None else str(v) for v in values])
+    categories, codes = np.unique(array, return_inverse=True)
+    #Dictionary-encode when there are at most half as many distinct values as rows
+    if 2 * len(categories) <= len(array):
+        dtype = np.int16 if len(categories) < 2**15 else np.int32
+        return "category", codes.astype(dtype), np.char.encode(categories, "utf-8")
+
+    return "string", np.char.encode(array, "utf-8"), None
+
+
+def _json_value(value):
+    """ Converts a graph attribute (possibly holding numpy scalars or arrays) for meta.json """
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [_json_value(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _json_value(v) for k, v in value.items()}
+
+    return value
+
+
+def write_graph(G, fp, compress=None):
+    """ Writes an igraph network to a binary graph directory
+
+    Args:
+        G (igraph object): network to save
+        fp (string): directory to write to (e.g., .../G_cpd_<update>.graph)
+        compress (list): attribute columns to gzip-compress, as "v_<attribute>",
+            "e_<attribute>" or "edges" - True compresses every column. Compressed columns
+            cannot be memory-mapped.
+
+    Returns:
+        None, but writes the graph to fp
+    """
+    os.makedirs(fp, exist_ok=True)
+
+    def compressed(name):
+        return compress is True or name in (compress or [])
+
+    meta = {
+        "n_vertices": G.vcount(),
+        "n_edges": G.ecount(),
+        "directed": G.is_directed(),
+        "graph_attributes": {a: _json_value(G[a]) for a in G.attributes()},
+        "columns": {},
+    }
+
+    edges = np.array(G.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    if G.vcount() < 2**31:
+        edges = edges.astype(np.int32)
+    _save_column(fp, "edges", edges, compressed("edges"))
+    meta["columns"]["edges"] = {"kind": "numeric", "compress": compressed("edges")}
+
+    for prefix, seq in [("v_", G.vs), ("e_", G.es)]:
+        for attribute in seq.attributes():
+            name = prefix + attribute
+            kind, array, categories = _encode_column(seq[attribute])
+            _save_column(fp, name, array, compressed(name))
+            if categories is not None:
+                _save_column(fp, name + ".values", categories)
+            meta["columns"][name] = {"kind": kind, "compress": compressed(name)}
+
+    with open(os.path.join(fp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def read_graph_arrays(fp, columns=None, mmap=True):
+    """ Reads a binary graph directory as numpy arrays, without building an igraph network
+
+    Dictionary-encoded columns are returned as their codes, with the distinct values under
+    "<column>.values" - e.g., G.vs["date"] is values[codes]. Strings are UTF-8 byte strings
+    (decode with np.char.decode(..., "utf-8")).
+
+    Args:
+        fp (string): directory written by write_graph()
+        columns (list): columns to read (e.g., ["edges", "v_name"]) - defaults to all
+        mmap (bool): memory-map uncompressed columns instead of reading them into memory
+
+    Returns:
+        dict: arrays of each column, plus "meta" (contents of meta.json)
+    """
+    with open(os.path.join(fp, "meta.json")) as f:
+        meta = json.load(f)
+
+    data = {"meta": meta}
+    for name, column in meta["columns"].items():
+        if columns is not None and name not in columns:
+            continue
+        data[name] = _load_column(fp, name, column["compress"], mmap)
+        if column["kind"] == "category":
+            data[name + ".values"] = _load_column(fp, name + ".values")
+
+    return data
+
+
+def _decode_column(data, name):
+    """ Converts a column read by read_graph_arrays() back into a list of attribute values """
+    kind = data["meta"]["columns"][name]["kind"]
+    if kind == "category":
+        return np.char.decode(np.asarray(data[name + ".values"]),
+                              "utf-8")[data[name]].tolist()
+    if kind == "string":
+        return np.char.decode(np.asarray(data[name]), "utf-8").tolist()
+
+    return np.asarray(data[name]).tolist()
+
+
+def read_graph(fp, columns=None):
+    """ Reads a binary graph directory into an igraph network
+
+    Args:
+        fp (string): directory written by write_graph()
+        columns (list): attribute columns to load (e.g., ["v_name"]) - defaults to all.
+            Edges are always loaded.
+
+    Returns:
+        G (igraph object): the stored network
+    """
+    data = read_graph_arrays(fp, None if columns is None else
+                             ["edges"] + list(columns))
+    meta = data["meta"]
+
+    G = ig.Graph(n=meta["n_vertices"], directed=meta["directed"])
+    G.add_edges(np.asarray(data["edges"]))
+
+    for name in meta["columns"]:
+        if name == "edges" or name not in data:
+            continue
+        seq = G.vs if name.startswith("v_") else G.es
+        seq[name[2:]] = _decode_column(data, name)
+
+    for attribute, value in meta["graph_attributes"].items():
+        G[attribute] = value
+
+    return G
+
+
+def convert_graph(in_fp, out_fp, compress=None):
+    """ Converts a stored .gmlz or .p (pickled) igraph network into a binary graph directory
+
+    Args:
+        in_fp (string): filepath of the .gmlz or .p network
+        out_fp (string): directory to write to
+        compress (list): see write_graph()
+
+    Returns:
+        None, but writes the graph to out_fp
+    """
+    if in_fp.endswith(".gmlz"):
+        G = ig.Graph.Read_GraphMLz(in_fp)
+    elif in_fp.endswith(".p"):
+        G = pickle.load(file=open(in_fp, "rb"))
+    else:
+        raise ValueError("Unknown graph format: " + in_fp)
+
+    write_graph(G, out_fp, compress)
+
+
+def benchmark_graph_store(n_vertices=200000, n_edges=2000000, seed=0,
+                          fp="Data/Graphs/benchmark"):
+    """ Compares load times of GraphMLz, pickle and binary graph storage
+
+    Builds a random network with the attributes of a cpd-cpd graph (vertex names & dates)
+    and times writing & reading it in each format.
+
+    Args:
+        n_vertices (int): number of vertices
+        n_edges (int): number of edges
+        seed (int): random seed
+        fp (string): filepath prefix of the benchmark files
+
+    Returns:
+        dict: runtime (seconds) of each format & operation
+    """
+    rng = np.random.default_rng(seed)
+    G = ig.Graph(n=n_vertices, edges=rng.integers(0, n_vertices, (n_edges, 2)))
+    G.vs["name"] = ["SCHEMBL" + str(i) for i in range(n_vertices)]
+    G.vs["date"] = [
+        "{}-{:02d}-{:02d}".format(y, m, d) for y, m, d in zip(
+            rng.integers(1976, 2022, n_vertices), rng.integers(1, 13, n_vertices),
+            rng.integers(1, 29, n_vertices))
+    ]
+
+    times = {}
+    start = time.time()
+    G.save(fp + ".gmlz", format="graphmlz")
+    times["gmlz write"] = time.time() - start
+    start = time.time()
+    ig.Graph.Read_GraphMLz(fp + ".gmlz")
+    times["gmlz read"] = time.time() - start
+
+    start = time.time()
+    pickle.dump(G, file=open(fp + ".p", "wb"))
+    times["pickle write"] = time.time() - start
+    start = time.time()
+    pickle.load(file=open(fp + ".p", "rb"))
+    times["pickle read"] = time.time() - start
+
+    start = time.time()
+    write_graph(G, fp + ".graph")
+    times["binary write"] = time.time() - start
+    start = time.time()
+    H = read_graph(fp + ".graph")
+    times["binary read"] = time.time() - start
+
+    assert H.get_edgelist() == G.get_edgelist()
+    assert H.vs["name"] == G.vs["name"] and H.vs["date"] == G.vs["date"]
+
+    for operation, runtime in times.items():
+        print("{}: {:.2f}s".format(operation, runtime))
+
+    return times
@@ -0,0 +1,169 @@
+""" Dense integer ids for SureChemBL compound & patent ids
+
+Replaces the cpd_ID_index_dict.p / patent_ID_index_dict.p pickles (huge Python
+dictionaries of "SCHEMBL..." strings) with a compact id table stored as .npy
+files in a directory, which can be memory-mapped by every script:
+
+    ids.npy: fixed-width byte strings, ids[i] is the id with index i
+    sorted_ids.npy: the same ids, sorted (for binary search lookups)
+    sorted_index.npy: index of each entry of sorted_ids
+
+Indicies never change once assigned - new ids (e.g. from a quarterly SureChemBL
+update) are appended with the next free indicies.
+
+"""
+
+import os
+import numpy as np
+
+
+def _save(fp, name, array):
+    """ Saves an array to fp/name.npy, replacing any existing file atomically """
+    np.save(os.path.join(fp, name + ".tmp.npy"), array)
+    os.replace(os.path.join(fp, name + ".tmp.npy"),
+               os.path.join(fp, name + ".npy"))
+
+
+def _as_bytes(ids):
+    """ Converts a list/array of ids into a numpy byte string array """
+    ids = np.asarray(ids)
+    if ids.dtype.kind == "S":
+        return ids
+    if len(ids) == 0:
+        return ids.astype("S1")
+
+    return ids.astype(str).astype("S")
+
+
+def _write(fp, ids):
+    """ Writes all files of an id table, given ids in index order """
+    os.makedirs(fp, exist_ok=True)
+
+    order = np.argsort(ids, kind="stable")
+    _save(fp, "ids", ids)
+    _save(fp, "sorted_ids", ids[order])
+    _save(fp, "sorted_index", order.astype(np.int64))
+
+
+def build_id_table(ids, fp):
+    """ Builds a new id table, numbering ids in order of first appearance
+
+    Args:
+        ids (list): SureChemBL ids (duplicates allowed)
+        fp (string): directory to write the id table to
+
+    Returns:
+        int: number of unique ids
+    """
+    ids = _as_bytes(ids)
+    _, first = np.unique(ids, return_index=True)
+    ids = ids[np.sort(first)]
+
+    _write(fp, ids)
+
+    return len(ids)
+
+
+def convert_id_dict(id_dict, fp):
+    """ Converts an existing {id: index} dictionary (e.g. cpd_ID_index_dict.p) into an id table
+
+    Indicies are kept, so igraph networks built from the dictionary stay valid. The
+    indicies must be 0 ... len(id_dict) - 1.
+
+    Args:
+        id_dict (dict): links ids with integer indicies
+        fp (string): directory to write the id table to
+
+    Returns:
+        int: number of ids
+    """
+    indicies = np.fromiter(id_dict.values(), dtype=np.int64, count=len(id_dict))
+    if not np.array_equal(np.sort(indicies), np.arange(len(id_dict))):
+        raise ValueError("Indicies must be 0 ... len(id_dict) - 1")
+
+    ids = np.empty(len(id_dict), dtype=_as_bytes(list(id_dict.keys())).dtype)
+    ids[indicies] = _as_bytes(list(id_dict.keys()))
+
+    _write(fp, ids)
+
+    return len(ids)
+
+
+def load_id_table(fp, mmap=True):
+    """ Loads an id table
+
+    Args:
+        fp (string): directory holding the id table
+        mmap (bool): memory-map the arrays instead of reading them into memory
+
+    Returns:
+        dict: "ids", "sorted_ids" and "sorted_index" arrays
+    """
+    mmap_mode = "r" if mmap else None
+
+    return {
+        name: np.load(os.path.join(fp, name + ".npy"), mmap_mode=mmap_mode)
+        for name in ["ids", "sorted_ids", "sorted_index"]
+    }
+
+
+def encode(table, ids):
+    """ Finds the integer index of every id
+
+    Args:
+        table (dict): id table (from load_id_table())
+        ids (list): SureChemBL ids
+
+    Returns:
+        numpy array: int64 index of every id, -1 where the id is not in the table
+    """
+    ids = _as_bytes(ids)
+    sorted_ids = table["sorted_ids"]
+    if len(ids) == 0 or len(sorted_ids) == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+
+    pos = np.minimum(sorted_ids.searchsorted(ids), len(sorted_ids) - 1)
+    found = sorted_ids[pos] == ids
+
+    return np.where(found, table["sorted_index"][pos], -1)
+
+
+def decode(table, indicies):
+    """ Finds the id of every integer index
+
+    Args:
+        table (dict): id table (from load_id_table())
+        indicies (array-like): integer indicies
+
+    Returns:
+        numpy array: ids (as str)
+    """
+    return np.asarray(table["ids"][np.asarray(indicies, dtype=np.int64)]).astype(str)
+
+
+def append_ids(fp, ids):
+    """ Adds ids which are not yet in an id table, keeping existing indicies
+
+    New ids are numbered in order of first appearance, after all existing ids. Creates
+    the table if it does not exist yet.
+
+    Args:
+        fp (string): directory holding the id table
+        ids (list): SureChemBL ids (duplicates & already known ids allowed)
+
+    Returns:
+        int: number of ids added
+    """
+    if not os.path.isfile(os.path.join(fp, "ids.npy")):
+        return build_id_table(ids, fp)
+
+    table = load_id_table(fp, mmap=False)
+    ids = _as_bytes(ids)
+    new = ids[encode(table, ids) == -1]
+    _, first = np.unique(new, return_index=True)
+    new = new[np.sort(first)]
+
+    if len(new) > 0:
+        _write(fp, np.concatenate([table["ids"], new]))
+
+    return len(new)
@@ -1,5 +1,6 @@
 import pickle
 from tqdm import tqdm
+import cpd_patent_store
 
 
 def build_month_increments(start, stop):
@@ -36,6 +37,26 @@ def read_ids(fp):
     return pickle.load(file=open(fp, "rb"))
 
 
+def read_month_ids(month, store_fp, pickle_fp):
+    """ Reads the unique SureChemBL compound ids of a month
+
+    Reads the cpd_dates table of the cpd_patent_store, falling back to the legacy
+    cpd_date_dict pickles for months not in the store (see cpd_patent_store.read_month()).
+
+    Args:
+        month (string): month, in the form YYYY-MM
+        store_fp (string): filepath to the root of the cpd_patent_store
+        pickle_fp (string): filepath to CpdPatentIdsDates directory
+
+    Returns:
+        list of unique SureChemBL ids
+    """
+    df = cpd_patent_store.read_month("cpd_dates", month, store_fp, columns=["cpdID"],
+                                     pickle_fp=pickle_fp)
+
+    return df["cpdID"].unique().tolist()
+
+
 def getIds(ids, allIds, month):
     """ Finds all new SureChemBL IDs added in a given month, as well as 
     which of those compounds were added to the LCC (and those which weren't)
@@ -108,14 +129,18 @@ def calculate_LCC_stats(allIds, lccIds, newIds, newlccIds, existing_newlccIds,
 
 def main():
     #Set up first month
-    fp = "/Volumes/Macintosh HD 4/SureChemBL/CpdPatentIdsDates/Unique_Cpds/"
-    ids = read_ids(fp + "unique_cpds_1962-01.p")
+    # fp = "/Volumes/Macintosh HD 4/SureChemBL/CpdPatentIdsDates/Unique_Cpds/"
+    # ids = read_ids(fp + "unique_cpds_1962-01.p")
+    #Unique compounds of each month - from the cpd_patent_store, or the legacy pickles
+    store_fp = "/Volumes/Macintosh HD 4/SureChemBL/CpdPatentStore/"
+    pickle_fp = "/Volumes/Macintosh HD 4/SureChemBL/CpdPatentIdsDates/"
+    ids = read_month_ids("1962-01", store_fp, pickle_fp)
     allIds = list(set(ids))
     # lccIds = ids[0] ## Leftover from largest connected component analysis
 
     for month in tqdm(build_month_increments(1963, 2022)):
         ### FIND NEW COMPOUNDS ###
-        ids = read_ids(fp + "unique_cpds_" + month + ".p")
+        ids = read_month_ids(month, store_fp, pickle_fp)
 
         newIds = getIds(ids, allIds, month)
 
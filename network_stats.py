@@ -0,0 +1,216 @@
+""" Monthly network statistics of SureChemBL in a single pass over the edge data
+
+Replaces the separate month loops of get_cpd_network_data.get_network_stats(),
+get_bipartite_network_data.get_network_stats() and get_patent_network_data.get_patent_stats()
+with one engine. Month-ordered cpd-patent edges (the temporal network, see
+temporal_bipartite.py) are read once, one month at a time. The engine keeps the running
+state of the network - cumulative degrees, present vertices & components (union-find, see
+component_tracker.py) - and passes it to each metric function, which returns that month's
+columns of the statistics table.
+
+A metric is any function taking the state dictionary and returning a dictionary of
+{column: value}. The state holds:
+    T: the temporal network
+    month, code: the month & its index in T["months"]
+    cpds, patents: endpoints of the edges added since the previous month of the run
+        (compound & patent id table indicies)
+    n_edges: number of edges up to & including the month
+    cpd_degrees, patent_degrees: cumulative degrees of every compound & patent
+    cpd_present, patent_present: masks of compounds & patents with an edge so far
+    new_cpds, new_patents: number of compounds & patents first seen in each month (by code)
+    parent, size: union-find over vertices (compounds, then patents offset by n_cpds)
+
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csgraph
+from tqdm import tqdm
+import temporal_bipartite
+import component_tracker
+import cpd_projection
+
+
+def bipartite_counts(state):
+    """ Number of vertices & edges of the cumulative cpd-patent network """
+    n_cpds = int(state["cpd_present"].sum())
+    n_patents = int(state["patent_present"].sum())
+
+    return {
+        "Nodes": n_cpds + n_patents,
+        "Edges": int(state["n_edges"]),
+        "Cpd Nodes": n_cpds,
+        "Patent Nodes": n_patents,
+    }
+
+
+def bipartite_degrees(state):
+    """ Average & maximum degrees of the cumulative cpd-patent network """
+    cpd_degrees = state["cpd_degrees"][state["cpd_present"]]
+    patent_degrees = state["patent_degrees"][state["patent_present"]]
+    if len(cpd_degrees) == 0:
+        return {}
+
+    return {
+        "Avg Degree": 2 * state["n_edges"] / (len(cpd_degrees) + len(patent_degrees)),
+        "Cpd Avg Degree": cpd_degrees.mean(),
+        "Patent Avg Degree": patent_degrees.mean(),
+        "Cpd Max Degree": int(cpd_degrees.max()),
+        "Patent Max Degree": int(patent_degrees.max()),
+    }
+
+
+def new_vertices(state):
+    """ Compounds & patents first seen in the month (see get_patent_network_data.get_patent_stats()) """
+    #Months without edges are not in T["months"] - their view falls back to an earlier month
+    months = state["T"]["months"]
+    if state["code"] < 0 or months[state["code"]] != state["month"]:
+        return {"New Cpds": 0, "New Patents": 0}
+
+    return {
+        "New Cpds": int(state["new_cpds"][state["code"]]),
+        "New Patents": int(state["new_patents"][state["code"]]),
+    }
+
+
+def month_patent_degree(state):
+    """ Average number of compound entries of the patents with edges in the month """
+    n_patents = len(np.unique(state["patents"]))
+
+    return {
+        "Month Patent Avg Degree": len(state["patents"]) / n_patents
+        if n_patents else np.nan
+    }
+
+
+def components(state):
+    """ Largest connected component & number of components of the cumulative network """
+    present = np.concatenate([state["cpd_present"], state["patent_present"]])
+    roots = np.flatnonzero(present & (state["parent"] == np.arange(len(present))))
+    sizes = state["size"][roots]
+
+    return {
+        "LCC Size": int(sizes.max()) if len(sizes) else 0,
+        "Components": len(roots),
+    }
+
+
+def cpd_cpd(state):
+    """ Statistics of the month's cpd-cpd network (see get_cpd_network_data.get_network_stats())
+
+    Compounds are linked when they appear in the same patent within the month. The network
+    is built as a sparse projection (see cpd_projection.py); edges & degrees count shared
+    patents, as in the unweighted multigraph.
+    """
+    cpds = np.asarray(state["cpds"])
+    if len(cpds) == 0:
+        return {}
+
+    #Renumber the month's patents & compounds
+    patents, rows = np.unique(state["patents"], return_inverse=True)
+    month_cpds, cols = np.unique(cpds, return_inverse=True)
+    B = cpd_projection.incidence_from_index(rows, cols, len(patents), len(month_cpds))
+    C = cpd_projection.project_cpd_cpd(B)
+
+    degrees = np.asarray(C.sum(axis=0)).ravel() + np.asarray(C.sum(axis=1)).ravel()
+    _, labels = csgraph.connected_components(C, directed=False)
+
+    return {
+        "Cpd-Cpd Nodes": len(month_cpds),
+        "Cpd-Cpd Edges": int(C.sum()),
+        "Cpd-Cpd Avg Degree": degrees.mean(),
+        "Cpd-Cpd Max Degree": int(degrees.max()),
+        "Cpd-Cpd LCC Size": int(np.bincount(labels).max()),
+    }
+
+
+DEFAULT_METRICS = [
+    bipartite_counts, bipartite_degrees, new_vertices, month_patent_degree,
+    components, cpd_cpd
+]
+
+
+def run_monthly_stats(T, months, metrics=DEFAULT_METRICS):
+    """ Computes statistics of every month in one pass over the month-ordered edges
+
+    Args:
+        T (dict): temporal network (see temporal_bipartite.load_temporal_bipartite())
+        months (list): sorted months (YYYY-MM) to compute statistics for - edges of months
+            in T before the first of these are added to the running state before the first
+            row, so every row's "cpds" & "patents" are the edges of that month alone
+        metrics (list): metric functions (see module docstring)
+
+    Returns:
+        pandas dataframe: one row per month, with a "Month" column and the columns of every
+        metric
+    """
+    n_cpds, n_patents = T["n_cpds"], T["n_patents"]
+    vertex_month = np.asarray(T["vertex_month"])
+    n_months = len(T["months"])
+
+    state = {
+        "T": T,
+        "n_edges": 0,
+        "cpd_degrees": np.zeros(n_cpds, dtype=np.int64),
+        "patent_degrees": np.zeros(n_patents, dtype=np.int64),
+        "new_cpds": np.bincount(vertex_month[:n_cpds][vertex_month[:n_cpds] >= 0],
+                                minlength=n_months),
+        "new_patents": np.bincount(vertex_month[n_cpds:][vertex_month[n_cpds:] >= 0],
+                                   minlength=n_months),
+        "parent": np.arange(n_cpds + n_patents, dtype=np.int64),
+        "size": np.ones(n_cpds + n_patents, dtype=np.int64),
+    }
+    root_map = np.arange(n_cpds + n_patents, dtype=np.int64)
+
+    #Seed the state with the edges of months before the first row
+    n_edges = T["edge_offsets"][np.searchsorted(T["months"], months[0], side="left")]
+    cpds = np.asarray(T["cpds"][:n_edges])
+    patents = np.asarray(T["patents"][:n_edges])
+    state["cpd_degrees"] += np.bincount(cpds, minlength=n_cpds)
+    state["patent_degrees"] += np.bincount(patents, minlength=n_patents)
+    component_tracker.merge_edges(state["parent"], state["size"], cpds,
+                                  patents.astype(np.int64) + n_cpds, root_map)
+    state["n_edges"] = int(n_edges)
+
+    data = []
+    for month in tqdm(months):
+        #New edges since the previous month
+        V = temporal_bipartite.month_view(T, month)
+        cpds = np.asarray(V["cpds"][state["n_edges"]:])
+        patents = np.asarray(V["patents"][state["n_edges"]:])
+
+        state["cpd_degrees"] += np.bincount(cpds, minlength=n_cpds)
+        state["patent_degrees"] += np.bincount(patents, minlength=n_patents)
+        component_tracker.merge_edges(state["parent"], state["size"], cpds,
+                                      patents.astype(np.int64) + n_cpds, root_map)
+
+        state["cpd_present"], state["patent_present"] = \
+            temporal_bipartite.view_vertices(V)
+        state.update({
+            "month": month,
+            "code": V["code"],
+            "cpds": cpds,
+            "patents": patents,
+            "n_edges": len(V["cpds"]),
+        })
+
+        row = {"Month": month}
+        for metric in metrics:
+            row.update(metric(state))
+        data.append(row)
+
+    return pd.DataFrame(data)
+
+
+def main():
+    from get_bipartite_network_data import build_month_list
+
+    fp = "../../../mnt/Archive/Shared/PatentData/SureChemBL/"
+
+    T = temporal_bipartite.load_temporal_bipartite(fp + "Graphs/cpd_patent_temporal/")
+    df = run_monthly_stats(T, build_month_list(1962, 2022))
+    df.to_csv(fp + "NetworkStats/networkStats_allMonths.csv")
+
+
+if __name__ == "__main__":
+    main()
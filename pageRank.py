@@ -52,8 +52,10 @@ def get_pageRank(G, month):
         G (igraph Graph): graph of a specific month
         month (str): month (to be used for file IO labeling)
     """
-    #Calculate pagerank
-    G.vs["pagerank"] = G.pagerank()
+    #Calculate pagerank - edge weights of weighted cpd-cpd graphs (number of shared patents)
+    # give the same result as the duplicate edges of the multigraph
+    weights = "weight" if "weight" in G.es.attributes() else None
+    G.vs["pagerank"] = G.pagerank(weights=weights)
 
     #Zip ChEMBL ids and pagerank values (don't care about the graph structure)
     pickle.dump(list(zip(G.vs["name"], G.vs["pagerank"])),
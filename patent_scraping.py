@@ -7,6 +7,8 @@ import pickle
 from tqdm import tqdm
 from random import sample
 import pandas as pd
+import cpd_patent_store
+import build_network
 
 
 def get_patentIDs(fp, n):
@@ -157,34 +159,40 @@ def build_month_increments(start, stop):
     return months
 
 
-def get_all_cpds(patents):
+def get_all_cpds(patents, store_fp=None):
     """ Get all compound IDs - filter down into a non-repeating list
 
     Args:
         patents (list): SureChemBL patent ID list
+        store_fp (string): filepath to a cpd_patent_store - if given, only the cpdID
+            column of the selected patents' rows is read (1980-2020 partitions)
 
     """
-
-    months = build_month_increments(1980, 2020)
-
-    files = []
-    for month in months:
-        files.append(
-            "Data/CpdPatentIdsDates/Patent_Cpd_Edges/patent_cpd_edges_" +
-            month + ".p")
-
-    cpds = []
-    for file in tqdm(files):
-        with open(file, "rb") as f:
+    if store_fp is not None:
+        cpds = cpd_patent_store.read_table("patent_cpd_edges",
+                                           store_fp,
+                                           columns=["cpdID"],
+                                           start="1980-01",
+                                           stop="2020-12",
+                                           isin={"patentID": patents})
+        cpds = cpds["cpdID"].tolist()
+
+    else:
+        months = build_month_increments(1980, 2020)
+
+        cpds = []
+        for month in tqdm(months):
+            #Reads either the compact patent_cpd_index_*.npz or legacy patent_cpd_edges_*.p file
             try:
-                edges = pickle.load(f)
-            except EOFError:
+                edges = build_network.load_patent_cpd_edges(
+                    "Data/CpdPatentIdsDates/Patent_Cpd_Edges/", "_" + month)
+            except (EOFError, FileNotFoundError):
                 edges = {}
 
-        selected_patents = [p for p in edges.keys() if p in patents]
+            selected_patents = [p for p in edges.keys() if p in patents]
 
-        for p in selected_patents:
-            cpds.extend(edges[p])
+            for p in selected_patents:
+                cpds.extend(edges[p])
 
     cpds = list(set(cpds))
 
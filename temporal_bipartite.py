@@ -0,0 +1,277 @@
+""" Month-by-month views of the full cpd-patent bipartite network
+
+Instead of building (and pickling) a G.subgraph() of the full network for every month,
+the network is stored once as a temporal edgelist:
+
+    months.npy: sorted months (YYYY-MM) - months are referred to by their index (code)
+    cpds.npy, patents.npy: edge endpoints (compound & patent id table indicies), sorted by
+        the month of the edge
+    edge_offsets.npy: edges of month code k are edges[edge_offsets[k]:edge_offsets[k + 1]]
+    vertex_month.npy: code of the first month each vertex (compounds, then patents) has an
+        edge, -1 if it has none
+
+A view of the network as of a month is the prefix of the sorted edges up to that month,
+so it is a slice of the arrays rather than a copy. Degrees & components are computed
+directly from the slice with numpy/scipy, without building an igraph network.
+
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
+from tqdm import tqdm
+import component_tracker
+
+
+def edge_month_codes(meta, months=None):
+    """ Finds the month of every edge of a bipartite edgelist
+
+    Args:
+        meta (dict): edgelist metadata (from build_network.load_bipartite_edges()), with
+            labels "YYYY-MM" or "YYYY-MM:<update>"
+        months (list): sorted months to code edges against (defaults to all months of the
+            edgelist)
+
+    Returns:
+        codes (numpy array): int16 index into months of every edge
+        months (list): sorted months
+    """
+    label_months = {label: label[:7] for label in meta["months"]}
+    if months is None:
+        months = sorted(set(label_months.values()))
+    month_codes = {month: code for code, month in enumerate(months)}
+
+    codes = np.full(meta["n_edges"], -1, dtype=np.int16)
+    for label, (start, end) in meta["months"].items():
+        if label_months[label] not in month_codes:
+            raise ValueError("Edge month not in months: " + label)
+        codes[start:end] = month_codes[label_months[label]]
+
+    return codes, list(months)
+
+
+def build_temporal_bipartite(patents, cpds, edge_months, months, n_cpds,
+                             n_patents):
+    """ Builds the temporal edgelist of the bipartite network
+
+    Args:
+        patents (array-like): patent id table indicies of every edge
+        cpds (array-like): compound id table indicies of every edge
+        edge_months (numpy array): month code of every edge (see edge_month_codes())
+        months (list): sorted months
+        n_cpds (int): number of compounds (patent vertices follow the compounds)
+        n_patents (int): number of patents
+
+    Returns:
+        dict: temporal network (see module docstring), plus "n_cpds" & "n_patents"
+    """
+    order = np.argsort(edge_months, kind="stable")
+    edge_months = np.asarray(edge_months)[order]
+
+    T = {
+        "months": np.asarray(months, dtype=str),
+        "cpds": np.asarray(cpds)[order],
+        "patents": np.asarray(patents)[order],
+        "edge_offsets": np.searchsorted(edge_months, np.arange(len(months) + 1)),
+        "n_cpds": n_cpds,
+        "n_patents": n_patents,
+    }
+
+    #First month of each vertex - edges are sorted, so the first edge of a vertex is its first month
+    vertex_month = np.full(n_cpds + n_patents, -1, dtype=np.int16)
+    for vertices in [T["cpds"], np.asarray(T["patents"], dtype=np.int64) + n_cpds]:
+        _, first = np.unique(vertices, return_index=True)
+        vertex_month[vertices[first]] = edge_months[first]
+    T["vertex_month"] = vertex_month
+
+    return T
+
+
+def save_temporal_bipartite(T, fp):
+    """ Saves a temporal network to a directory of .npy files
+
+    Args:
+        T (dict): temporal network (from build_temporal_bipartite())
+        fp (string): directory to write to
+
+    Returns:
+        None
+    """
+    os.makedirs(fp, exist_ok=True)
+    for name in ["months", "cpds", "patents", "edge_offsets", "vertex_month"]:
+        np.save(os.path.join(fp, name + ".npy"), T[name])
+    np.save(os.path.join(fp, "sizes.npy"), np.array([T["n_cpds"], T["n_patents"]]))
+
+
+def load_temporal_bipartite(fp, mmap=True):
+    """ Loads a temporal network saved by save_temporal_bipartite()
+
+    Args:
+        fp (string): directory holding the temporal network
+        mmap (bool): memory-map the edge arrays instead of reading them into memory
+
+    Returns:
+        dict: temporal network
+    """
+    mmap_mode = "r" if mmap else None
+    T = {
+        name: np.load(os.path.join(fp, name + ".npy"), mmap_mode=mmap_mode)
+        for name in ["cpds", "patents", "vertex_month"]
+    }
+    T["months"] = np.load(os.path.join(fp, "months.npy"))
+    T["edge_offsets"] = np.load(os.path.join(fp, "edge_offsets.npy"))
+    T["n_cpds"], T["n_patents"] = np.load(os.path.join(fp, "sizes.npy")).tolist()
+
+    return T
+
+
+def month_view(T, month):
+    """ Views the network as of a month (all edges & vertices up to and including it)
+
+    Args:
+        T (dict): temporal network
+        month (string): month, in the form YYYY-MM
+
+    Returns:
+        dict: "T" (the temporal network), "month", "code" (index of the last month
+        included), and "cpds" & "patents" edge arrays (slices of T, not copies)
+    """
+    code = int(np.searchsorted(T["months"], month, side="right")) - 1
+    n_edges = T["edge_offsets"][code + 1]
+
+    return {
+        "T": T,
+        "month": month,
+        "code": code,
+        "cpds": T["cpds"][:n_edges],
+        "patents": T["patents"][:n_edges],
+    }
+
+
+def view_vertices(V):
+    """ Finds the vertices present in a view
+
+    Args:
+        V (dict): view of the network (from month_view())
+
+    Returns:
+        cpd_mask, patent_mask (numpy arrays): boolean masks over compound & patent id
+        table indicies
+    """
+    T = V["T"]
+    present = (T["vertex_month"] >= 0) & (T["vertex_month"] <= V["code"])
+
+    return present[:T["n_cpds"]], present[T["n_cpds"]:]
+
+
+def view_degrees(V):
+    """ Finds compound & patent degrees in a view
+
+    Args:
+        V (dict): view of the network (from month_view())
+
+    Returns:
+        cpd_degrees, patent_degrees (numpy arrays): degree of every compound & patent id
+        table index (0 for vertices not yet present)
+    """
+    T = V["T"]
+
+    return (np.bincount(V["cpds"], minlength=T["n_cpds"]),
+            np.bincount(V["patents"], minlength=T["n_patents"]))
+
+
+def view_components(V):
+    """ Finds the connected components of a view
+
+    Args:
+        V (dict): view of the network (from month_view())
+
+    Returns:
+        numpy array: sizes of all components of present vertices, largest first
+    """
+    T = V["T"]
+    n = T["n_cpds"] + T["n_patents"]
+    A = sparse.coo_matrix(
+        (np.ones(len(V["cpds"]), dtype=bool),
+         (V["cpds"], np.asarray(V["patents"], dtype=np.int64) + T["n_cpds"])),
+        shape=(n, n))
+
+    _, labels = csgraph.connected_components(A, directed=False)
+    cpd_mask, patent_mask = view_vertices(V)
+    sizes = np.bincount(labels[np.concatenate([cpd_mask, patent_mask])])
+
+    return np.sort(sizes[sizes > 0])[::-1]
+
+
+def view_stats(V, components=None):
+    """ Finds basic network statistics of a view (see get_bipartite_network_data.get_network_stats())
+
+    Unlike the G.subgraph() networks, only patents with an edge up to the month are
+    counted.
+
+    Args:
+        V (dict): view of the network (from month_view())
+        components (numpy array): component sizes of the view, if already known (see
+            view_components())
+
+    Returns:
+        dict: network statistics
+    """
+    if components is None:
+        components = view_components(V)
+    cpd_mask, patent_mask = view_vertices(V)
+
+    n_cpds, n_patents = cpd_mask.sum(), patent_mask.sum()
+    n_edges = len(V["cpds"])
+
+    return {
+        "Month": V["month"],
+        "Nodes": int(n_cpds + n_patents),
+        "Edges": n_edges,
+        "Cpd Nodes": int(n_cpds),
+        "Patent Nodes": int(n_patents),
+        "Avg Degree": 2 * n_edges / max(n_cpds + n_patents, 1),
+        "Cpd Avg Degree": n_edges / max(n_cpds, 1),
+        "Patent Avg Degree": n_edges / max(n_patents, 1),
+        "LCC Size": int(components[0]) if len(components) else 0,
+        "Components": len(components),
+    }
+
+
+def temporal_network_stats(T, months):
+    """ Finds network statistics of every month in one pass over the temporal network
+
+    Each month's new edges are merged into a union-find over all vertices (see
+    component_tracker.py), so components are updated rather than recomputed from the
+    whole prefix of edges.
+
+    Args:
+        T (dict): temporal network
+        months (list): sorted months to compute statistics for
+
+    Returns:
+        pandas dataframe: one row of statistics (see view_stats()) per month
+    """
+    n = T["n_cpds"] + T["n_patents"]
+    parent = np.arange(n, dtype=np.int64)
+    root_map = np.arange(n, dtype=np.int64)
+    size = np.ones(n, dtype=np.int64)
+    n_edges = 0
+
+    data = []
+    for month in tqdm(months):
+        V = month_view(T, month)
+        component_tracker.merge_edges(
+            parent, size, np.asarray(V["cpds"][n_edges:]),
+            np.asarray(V["patents"][n_edges:], dtype=np.int64) + T["n_cpds"],
+            root_map)
+        n_edges = len(V["cpds"])
+
+        present = np.concatenate(view_vertices(V))
+        sizes = size[np.flatnonzero(present & (parent == root_map))]
+
+        data.append(view_stats(V, np.sort(sizes)[::-1]))
+
+    return pd.DataFrame(data)